@@ -40,3 +40,38 @@ def rearrange(line):
             line_copy[line_copy_idx] = line[idx]
             line_copy_idx += 1
     return line_copy
+
+
+def merge_lines(lines):
+    """
+    Function that merges a whole batch of rows or columns in one pass.
+    Identical lines within the batch are only merged once.
+
+    Returns a tuple (merged_lines, changed, scores) where changed[idx]
+    tells whether lines[idx] was modified and scores[idx] is the sum
+    of the tiles created by merging it.
+    """
+    results = {}
+    merged_lines = []
+    changed = []
+    scores = []
+    
+    for line in lines:
+        key = tuple(line)
+        if key not in results:
+            line_merged = rearrange(line)
+            score = 0
+            for idx in range(len(line_merged) - 1):
+                if line_merged[idx] != 0 and line_merged[idx] == line_merged[idx + 1]:
+                    line_merged[idx] = 2 * line_merged[idx]
+                    line_merged[idx + 1] = 0
+                    score += line_merged[idx]
+            line_merged = rearrange(line_merged)
+            results[key] = (line_merged, line_merged != list(line), score)
+        
+        line_merged, line_changed, score = results[key]
+        merged_lines.append(list(line_merged))
+        changed.append(line_changed)
+        scores.append(score)
+    
+    return merged_lines, changed, scores
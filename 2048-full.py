@@ -4,6 +4,8 @@ Clone of 2048 game.
 
 import poc_2048_gui
 import random
+import time
+from collections import OrderedDict
 
 # Directions, DO NOT MODIFY
 UP = 1
@@ -11,6 +13,9 @@ DOWN = 2
 LEFT = 3
 RIGHT = 4
 
+# Number of moves that can be taken back with undo().
+UNDO_LIMIT = 100
+
 # Offsets for computing tile indices in each direction.
 # DO NOT MODIFY this dictionary.
 OFFSETS = {UP: (1, 0),
@@ -57,16 +62,203 @@ def rearrange(line):
     return line_copy
 
 
+def merge_lines(lines):
+    """
+    Function that merges a whole batch of rows or columns in one pass.
+    Identical lines within the batch are only merged once.
+
+    Returns a tuple (merged_lines, changed, scores) where changed[idx]
+    tells whether lines[idx] was modified and scores[idx] is the sum
+    of the tiles created by merging it.
+    """
+    results = {}
+    merged_lines = []
+    changed = []
+    scores = []
+    
+    for line in lines:
+        key = tuple(line)
+        if key not in results:
+            line_merged = rearrange(line)
+            score = 0
+            for idx in range(len(line_merged) - 1):
+                if line_merged[idx] != 0 and line_merged[idx] == line_merged[idx + 1]:
+                    line_merged[idx] = 2 * line_merged[idx]
+                    line_merged[idx + 1] = 0
+                    score += line_merged[idx]
+            line_merged = rearrange(line_merged)
+            results[key] = (line_merged, line_merged != list(line), score)
+        
+        line_merged, line_changed, score = results[key]
+        merged_lines.append(list(line_merged))
+        changed.append(line_changed)
+        scores.append(score)
+    
+    return merged_lines, changed, scores
+
+
+class MergeCache:
+    """
+    Class that memoizes merge() for lines of any width, keeping the
+    capacity most recently used lines.  Instances are called like
+    merge() and can be handed to TwentyFortyEight.set_merge_function().
+    A capacity of 0 counts lookups without caching anything.
+    """
+
+    def __init__(self, capacity=65536):
+        if capacity < 0:
+            raise ValueError("capacity must not be negative")
+        self._capacity = capacity
+        self._lines = OrderedDict()
+        self.reset_stats()
+
+    def __call__(self, line):
+        """
+        Return merge(line), from the cache if possible.
+        """
+        key = tuple(line)
+        merged = self._lines.pop(key, None)
+        if merged is None:
+            self._misses += 1
+            merged = tuple(merge(line))
+            if not self._capacity:
+                return list(merged)
+            if len(self._lines) >= self._capacity:
+                self._lines.popitem(False)
+                self._evictions += 1
+        else:
+            self._hits += 1
+        
+        # re-inserting moves the line to the most recently used end
+        self._lines[key] = merged
+        return list(merged)
+
+    def __len__(self):
+        """
+        Return the number of cached lines.
+        """
+        return len(self._lines)
+
+    def clear(self):
+        """
+        Drop all cached lines, keeping the statistics.
+        """
+        self._lines.clear()
+
+    def reset_stats(self):
+        """
+        Reset the hit, miss and eviction counters.
+        """
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get_stats(self):
+        """
+        Return a dictionary with the cache statistics.
+        """
+        lookups = self._hits + self._misses
+        hit_rate = 0.0
+        if lookups:
+            hit_rate = self._hits / float(lookups)
+        return {"hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_rate": hit_rate,
+                "size": len(self._lines),
+                "capacity": self._capacity}
+
+
+def line_cells(grid_height, grid_width, direction):
+    """
+    Function that returns, for the given direction, the list of
+    lines of (row, col) cells in the order they are fed to merge().
+    """
+    if direction == UP:
+        return [[(row, col) for row in range(grid_height)]
+                for col in range(grid_width)]
+    elif direction == DOWN:
+        return [[(row, col) for row in range(grid_height - 1, -1, -1)]
+                for col in range(grid_width)]
+    elif direction == LEFT:
+        return [[(row, col) for col in range(grid_width)]
+                for row in range(grid_height)]
+    else:
+        return [[(row, col) for col in range(grid_width - 1, -1, -1)]
+                for row in range(grid_height)]
+
+def merge_boards(boards, direction):
+    """
+    Function that moves a batch of equally sized grids (lists of
+    lists) in the same direction with a single merge_lines() call.
+
+    Returns a tuple (new_boards, changed, scores) with one entry per
+    board.  No new tiles are added.
+    """
+    if not boards:
+        return [], [], []
+    
+    cells = line_cells(len(boards[0]), len(boards[0][0]), direction)
+    lines = [[grid[row][col] for row, col in line]
+             for grid in boards for line in cells]
+    merged_lines, changed_lines, score_lines = merge_lines(lines)
+    
+    new_boards = []
+    changed = []
+    scores = []
+    idx = 0
+    for grid in boards:
+        new_grid = [list(row) for row in grid]
+        for line in cells:
+            for pos, (row, col) in enumerate(line):
+                new_grid[row][col] = merged_lines[idx][pos]
+            idx += 1
+        new_boards.append(new_grid)
+        changed.append(any(changed_lines[idx - len(cells):idx]))
+        scores.append(sum(score_lines[idx - len(cells):idx]))
+    
+    return new_boards, changed, scores
+
+
+def slide_board(board, grid_height, grid_width, direction):
+    """
+    Function that moves all tiles of a flat, row-major tuple board in
+    the given direction without adding a new tile.
+
+    Returns a tuple (new_board, score).
+    """
+    cells = line_cells(grid_height, grid_width, direction)
+    lines = [[board[row * grid_width + col] for row, col in line]
+             for line in cells]
+    merged_lines, dummy_changed, scores = merge_lines(lines)
+    
+    new_board = list(board)
+    for line, merged in zip(cells, merged_lines):
+        for (row, col), value in zip(line, merged):
+            new_board[row * grid_width + col] = value
+    
+    return tuple(new_board), sum(scores)
+
+
 class TwentyFortyEight:
     """
     Class to run the game logic.
     """
 
-    def __init__(self, grid_height, grid_width):
+    def __init__(self, grid_height, grid_width, rng=random):
         # initialise the height and width of the 2048 board
         self._grid_height = grid_height
         self._grid_width = grid_width
         
+        # source of randomness for new tiles, e.g. a seeded random.Random
+        self._rng = rng
+        
+        # function used to merge lines, see set_merge_function
+        self._merge = merge
+        
+        # GameRecorder that logs every game, see set_recorder
+        self._recorder = None
+        
         # call the reset method to create an empty grid except
         # for two initial tiles
         self.reset()
@@ -77,8 +269,6 @@ class TwentyFortyEight:
                                LEFT : self.traverse_grid((0, 0), (1, 0), self._grid_height),
                                RIGHT : self.traverse_grid((0, self._grid_width - 1), (1, 0), self._grid_height)}
         
-        print self._initial_list
-        
     def traverse_grid(self, start_cell, direction, num_steps):
         """
         Function that iterates through the cells in a grid
@@ -131,9 +321,46 @@ class TwentyFortyEight:
         # create an empty list with all 0s
         self._grid = [[0 * (row + col) for col in range(self._grid_width)]
                       for row in range(self._grid_height)]
+        # snapshots of the board before each of the last moves
+        self._undo_stack = []
         # call method to initialise two of the tiles of the grid
         self.new_tile()
         self.new_tile()
+        if self._recorder is not None:
+            self._recorder.start_game(self)
+
+    def snapshot(self):
+        """
+        Return an immutable copy of the board: a flat row-major
+        tuple of tile values.
+        """
+        return tuple([value for row in self._grid for value in row])
+
+    def restore(self, snapshot):
+        """
+        Set the board to a copy previously returned by snapshot().
+        """
+        width = self._grid_width
+        self._grid = [list(snapshot[row * width:(row + 1) * width])
+                      for row in range(self._grid_height)]
+
+    def undo(self):
+        """
+        Take back the last move that changed the board, including the
+        tile it added.  Returns False if there is nothing to undo.
+        """
+        if not self._undo_stack:
+            return False
+        self.restore(self._undo_stack.pop())
+        return True
+
+    def _push_undo(self, snapshot):
+        """
+        Remember the board before a move for undo().
+        """
+        self._undo_stack.append(snapshot)
+        if len(self._undo_stack) > UNDO_LIMIT:
+            del self._undo_stack[0]
 
     def __str__(self):
         """
@@ -152,6 +379,24 @@ class TwentyFortyEight:
         """
         return self._grid_height
 
+    def set_merge_function(self, merge_function):
+        """
+        Use merge_function, e.g. a MergeCache, instead of merge()
+        when moving tiles.
+        """
+        self._merge = merge_function
+
+    def set_recorder(self, recorder):
+        """
+        Log this game, starting from the current board, and every
+        game after the next reset() with the given GameRecorder.
+        Pass None to stop recording.  Boards changed through
+        set_tile(), restore() or undo() are not recorded.
+        """
+        self._recorder = recorder
+        if recorder is not None:
+            recorder.start_game(self)
+
     def get_grid_width(self):
         """
         Get the width of the board.
@@ -161,29 +406,38 @@ class TwentyFortyEight:
     def move(self, direction):
         """
         Move all tiles in the given direction and add
-        a new tile if any tiles moved.
+        a new tile if any tiles moved.  Returns whether the
+        board changed.
         """
-        before = self.__str__()
+        changed = False
         for tiles in self._initial_list[direction]:
             if direction == UP or direction == DOWN:
-                temp_list = self.traverse_grid_value(tiles, OFFSETS[direction], self._grid_height)
+                num_steps = self._grid_height
             elif direction == LEFT or direction == RIGHT:
-                temp_list = self.traverse_grid_value(tiles, OFFSETS[direction], self._grid_width)
-            temp_list = merge(temp_list)
+                num_steps = self._grid_width
+            temp_list = self.traverse_grid_value(tiles, OFFSETS[direction], num_steps)
+            merged_list = self._merge(temp_list)
+            if merged_list == temp_list:
+                continue
             
-            if direction == UP or direction == DOWN: 
-                self.traverse_grid_store(tiles, OFFSETS[direction], self._grid_height, temp_list)
-            elif direction == LEFT or direction == RIGHT:
-                self.traverse_grid_store(tiles, OFFSETS[direction], self._grid_width, temp_list)
-        after = self.__str__()
-        if before != after:
-            self.new_tile()
+            # the lines before this one did not change, so the board
+            # still is as it was before the move
+            if not changed:
+                self._push_undo(self.snapshot())
+                changed = True
+            self.traverse_grid_store(tiles, OFFSETS[direction], num_steps, merged_list)
+        if changed:
+            spawn = self.new_tile()
+            if self._recorder is not None:
+                self._recorder.record_move(direction, spawn)
+        return changed
 
     def new_tile(self):
         """
         Create a new tile in a randomly selected empty
         square.  The tile should be 2 90% of the time and
-        4 10% of the time.
+        4 10% of the time.  Returns (row, col, value) of
+        the new tile.
         """
         empty_index = []        
         
@@ -192,12 +446,13 @@ class TwentyFortyEight:
                 if self._grid[row][col] == 0:
                     empty_index.append((row, col))
                     
-        pos = random.choice(empty_index)
+        pos = self._rng.choice(empty_index)
         
-        if random.random() < 0.9:
+        if self._rng.random() < 0.9:
             self._grid[pos[0]][pos[1]] = 2
         else:
             self._grid[pos[0]][pos[1]] = 4
+        return pos[0], pos[1], self._grid[pos[0]][pos[1]]
                    
     def set_tile(self, row, col, value):
         """
@@ -212,4 +467,984 @@ class TwentyFortyEight:
         return self._grid[row][col]
 
 
-poc_2048_gui.run_gui(TwentyFortyEight(5, 6))
+class TwentyFortyEightLarge(TwentyFortyEight):
+    """
+    TwentyFortyEight for large boards.  The grid is a flat array,
+    the cells of every line are precomputed as flat indices, and the
+    empty squares are kept in an incrementally updated index, so a
+    new tile costs O(1) and a move O(cells).
+    """
+
+    def __init__(self, grid_height, grid_width, rng=random):
+        TwentyFortyEight.__init__(self, grid_height, grid_width, rng)
+        
+        # flat indices of every line, in the order they are merged
+        self._lines = {}
+        for direction in (UP, DOWN, LEFT, RIGHT):
+            self._lines[direction] = [
+                [row * grid_width + col for row, col in line]
+                for line in line_cells(grid_height, grid_width, direction)]
+
+    def reset(self):
+        """
+        Reset the game so the grid is empty except for two
+        initial tiles.
+        """
+        # array, struct and mmap are not available in CodeSkulptor, so
+        # they are only imported by the classes that need them
+        from array import array
+        self._undo_stack = []
+        self._cells = array("l", [0]) * (self._grid_height * self._grid_width)
+        self._rebuild_empty()
+        self.new_tile()
+        self.new_tile()
+        if self._recorder is not None:
+            self._recorder.start_game(self)
+
+    def _rebuild_empty(self):
+        """
+        Recompute the index of empty squares from scratch.  _empty
+        lists the empty squares and _empty_pos maps a square to its
+        position in _empty, or -1 if the square holds a tile.
+        """
+        from array import array
+        self._empty = array("l")
+        self._empty_pos = array("l", [-1]) * len(self._cells)
+        for idx in range(len(self._cells)):
+            if not self._cells[idx]:
+                self._empty_pos[idx] = len(self._empty)
+                self._empty.append(idx)
+
+    def _set_cell(self, idx, value):
+        """
+        Store a value in a square, keeping the empty index current.
+        """
+        old_value = self._cells[idx]
+        self._cells[idx] = value
+        if value and not old_value:
+            # swap the last empty square into the freed slot
+            pos = self._empty_pos[idx]
+            last = self._empty.pop()
+            if last != idx:
+                self._empty[pos] = last
+                self._empty_pos[last] = pos
+            self._empty_pos[idx] = -1
+        elif old_value and not value:
+            self._empty_pos[idx] = len(self._empty)
+            self._empty.append(idx)
+
+    def __str__(self):
+        """
+        Return a string representation of the grid for debugging.
+        """
+        grid_string = ""
+        width = self._grid_width
+        
+        for row in range(self._grid_height):
+            grid_string += str(list(self._cells[row * width:(row + 1) * width])) + "\n"
+            
+        return grid_string
+
+    def snapshot(self):
+        """
+        Return an immutable copy of the board: a flat row-major
+        tuple of tile values.
+        """
+        return tuple(self._cells)
+
+    def restore(self, snapshot):
+        """
+        Set the board to a copy previously returned by snapshot().
+        """
+        from array import array
+        self._cells = array("l", snapshot)
+        self._rebuild_empty()
+
+    def move(self, direction):
+        """
+        Move all tiles in the given direction and add
+        a new tile if any tiles moved.  Returns whether the
+        board changed.
+        """
+        cells = self._cells
+        changed = False
+        for line in self._lines[direction]:
+            temp_list = [cells[idx] for idx in line]
+            merged_list = self._merge(temp_list)
+            if merged_list == temp_list:
+                continue
+            
+            if not changed:
+                self._push_undo(self.snapshot())
+                changed = True
+            for idx, old_value, value in zip(line, temp_list, merged_list):
+                if value != old_value:
+                    self._set_cell(idx, value)
+        if changed:
+            spawn = self.new_tile()
+            if self._recorder is not None:
+                self._recorder.record_move(direction, spawn)
+        return changed
+
+    def new_tile(self):
+        """
+        Create a new tile in a randomly selected empty
+        square.  The tile should be 2 90% of the time and
+        4 10% of the time.  Returns (row, col, value) of
+        the new tile.
+        """
+        idx = self._empty[self._rng.randrange(len(self._empty))]
+        
+        if self._rng.random() < 0.9:
+            self._set_cell(idx, 2)
+        else:
+            self._set_cell(idx, 4)
+        return idx // self._grid_width, idx % self._grid_width, self._cells[idx]
+
+    def set_tile(self, row, col, value):
+        """
+        Set the tile at position row, col to have the given value.
+        """
+        self._set_cell(row * self._grid_width + col, value)
+
+    def get_tile(self, row, col):
+        """
+        Return the value of the tile at position row, col.
+        """
+        return self._cells[row * self._grid_width + col]
+
+
+# Bitboard engine for the standard 4x4 board.  The whole grid lives in
+# a single 64-bit integer: each tile is stored as the log2 of its value
+# in a 4-bit nibble (0 for an empty square), row-major with (0, 0) in
+# the lowest nibble.  Tiles are therefore limited to 2 ** 15 = 32768.
+
+BITBOARD_SIZE = 4
+ROW_MASK = 0xFFFF
+NIBBLE_MASK = 0xF
+MAX_TILE_LOG = 15
+
+# row move tables, indexed by a 16-bit row, filled in by build_row_tables
+ROW_LEFT_TABLE = []
+ROW_RIGHT_TABLE = []
+ROW_SCORE_TABLE = []
+
+def reverse_row(row):
+    """
+    Function that reverses the order of the four nibbles of a row.
+    """
+    return (((row & 0xF) << 12) | ((row & 0xF0) << 4) |
+            ((row >> 4) & 0xF0) | ((row >> 12) & 0xF))
+
+def merge_capped_row(logs):
+    """
+    Function that merges a row of log2 tile values like merge(), except
+    that two 32768 tiles are not merged.
+
+    Returns a tuple (merged, score) with merged holding tile values.
+    """
+    tiles = [log for log in logs if log]
+    merged = []
+    score = 0
+    idx = 0
+    while idx < len(tiles):
+        if (idx + 1 < len(tiles) and tiles[idx] == tiles[idx + 1]
+                and tiles[idx] < MAX_TILE_LOG):
+            merged.append(1 << (tiles[idx] + 1))
+            score += merged[-1]
+            idx += 2
+        else:
+            merged.append(1 << tiles[idx])
+            idx += 1
+    merged.extend([0] * (len(logs) - len(merged)))
+    return merged, score
+
+def build_row_tables():
+    """
+    Function that precomputes the result of moving every possible
+    16-bit row to the left and to the right.  The tables are built
+    with merge() so that both engines agree on every row.
+    """
+    if ROW_LEFT_TABLE:
+        return
+    left_table = [0] * (ROW_MASK + 1)
+    score_table = [0] * (ROW_MASK + 1)
+    for row in range(ROW_MASK + 1):
+        line = [((row >> (4 * idx)) & NIBBLE_MASK) for idx in range(BITBOARD_SIZE)]
+        values = [(1 << log) if log else 0 for log in line]
+        merged_lines, dummy_changed, scores = merge_lines([values])
+        merged = merged_lines[0]
+        
+        # a 65536 tile cannot be stored in a nibble, so two 32768
+        # tiles slide without merging while the other pairs merge
+        if max(merged) > (1 << MAX_TILE_LOG):
+            merged, scores[0] = merge_capped_row(line)
+        score_table[row] = scores[0]
+        
+        result = 0
+        for idx in range(BITBOARD_SIZE):
+            if merged[idx]:
+                result |= (merged[idx].bit_length() - 1) << (4 * idx)
+        left_table[row] = result
+    
+    right_table = [0] * (ROW_MASK + 1)
+    for row in range(ROW_MASK + 1):
+        right_table[row] = reverse_row(left_table[reverse_row(row)])
+    
+    ROW_LEFT_TABLE.extend(left_table)
+    ROW_RIGHT_TABLE.extend(right_table)
+    ROW_SCORE_TABLE.extend(score_table)
+
+def transpose_board(board):
+    """
+    Function that transposes a 4x4 bitboard so that columns
+    become rows.
+    """
+    diag_a = board & 0xF0F00F0FF0F00F0F
+    diag_b = board & 0x0000F0F00000F0F0
+    diag_c = board & 0x0F0F00000F0F0000
+    board = diag_a | (diag_b << 12) | (diag_c >> 12)
+    diag_a = board & 0xFF00FF0000FF00FF
+    diag_b = board & 0x00FF00FF00000000
+    diag_c = board & 0x00000000FF00FF00
+    return diag_a | (diag_b >> 24) | (diag_c << 24)
+
+def move_rows(board, table):
+    """
+    Function that applies a row table to all four rows of a bitboard.
+    """
+    return (table[board & ROW_MASK] |
+            (table[(board >> 16) & ROW_MASK] << 16) |
+            (table[(board >> 32) & ROW_MASK] << 32) |
+            (table[(board >> 48) & ROW_MASK] << 48))
+
+def move_board(board, direction):
+    """
+    Function that moves all tiles of a bitboard in the given
+    direction and returns the new bitboard.
+    """
+    if direction == LEFT:
+        return move_rows(board, ROW_LEFT_TABLE)
+    elif direction == RIGHT:
+        return move_rows(board, ROW_RIGHT_TABLE)
+    elif direction == UP:
+        return transpose_board(move_rows(transpose_board(board), ROW_LEFT_TABLE))
+    else:
+        return transpose_board(move_rows(transpose_board(board), ROW_RIGHT_TABLE))
+
+def board_move_score(board, direction):
+    """
+    Function that returns the score gained by moving a bitboard in
+    the given direction.  A row scores the same moved either way.
+    """
+    if direction == UP or direction == DOWN:
+        board = transpose_board(board)
+    return (ROW_SCORE_TABLE[board & ROW_MASK] +
+            ROW_SCORE_TABLE[(board >> 16) & ROW_MASK] +
+            ROW_SCORE_TABLE[(board >> 32) & ROW_MASK] +
+            ROW_SCORE_TABLE[(board >> 48) & ROW_MASK])
+
+
+class TwentyFortyEightBitboard:
+    """
+    Class to run the game logic on a 4x4 board packed into a
+    64-bit integer.  Behaves exactly like TwentyFortyEight(4, 4),
+    including the order in which random numbers are drawn, as long
+    as no two 32768 tiles meet: tiles are capped at 32768, so such a
+    pair slides without merging while the rest of the row moves.
+    """
+
+    def __init__(self, rng=random):
+        build_row_tables()
+        self._grid_height = BITBOARD_SIZE
+        self._grid_width = BITBOARD_SIZE
+        self._rng = rng
+        self._recorder = None
+        self.reset()
+
+    def reset(self):
+        """
+        Reset the game so the grid is empty except for two
+        initial tiles.
+        """
+        self._board = 0
+        self._undo_stack = []
+        self.new_tile()
+        self.new_tile()
+        if self._recorder is not None:
+            self._recorder.start_game(self)
+
+    def snapshot(self):
+        """
+        Return an immutable copy of the board: the packed integer.
+        """
+        return self._board
+
+    def restore(self, snapshot):
+        """
+        Set the board to a copy previously returned by snapshot().
+        """
+        self._board = snapshot
+
+    def undo(self):
+        """
+        Take back the last move that changed the board, including the
+        tile it added.  Returns False if there is nothing to undo.
+        """
+        if not self._undo_stack:
+            return False
+        self._board = self._undo_stack.pop()
+        return True
+
+    def __str__(self):
+        """
+        Return a string representation of the grid for debugging.
+        """
+        grid_string = ""
+        
+        for row in range(self._grid_height):
+            grid_string += str([self.get_tile(row, col)
+                                for col in range(self._grid_width)]) + "\n"
+            
+        return grid_string
+
+    def get_grid_height(self):
+        """
+        Get the height of the board.
+        """
+        return self._grid_height
+
+    def get_grid_width(self):
+        """
+        Get the width of the board.
+        """
+        return self._grid_width
+
+    def get_board(self):
+        """
+        Return the packed 64-bit representation of the board.
+        """
+        return self._board
+
+    def set_recorder(self, recorder):
+        """
+        Log this game, starting from the current board, and every
+        game after the next reset() with the given GameRecorder.
+        Pass None to stop recording.  Boards changed through
+        set_tile(), restore() or undo() are not recorded.
+        """
+        self._recorder = recorder
+        if recorder is not None:
+            recorder.start_game(self)
+
+    def move(self, direction):
+        """
+        Move all tiles in the given direction and add
+        a new tile if any tiles moved.  Returns whether the
+        board changed.
+        """
+        new_board = move_board(self._board, direction)
+        if new_board == self._board:
+            return False
+        self._undo_stack.append(self._board)
+        if len(self._undo_stack) > UNDO_LIMIT:
+            del self._undo_stack[0]
+        self._board = new_board
+        spawn = self.new_tile()
+        if self._recorder is not None:
+            self._recorder.record_move(direction, spawn)
+        return True
+
+    def new_tile(self):
+        """
+        Create a new tile in a randomly selected empty
+        square.  The tile should be 2 90% of the time and
+        4 10% of the time.  Returns (row, col, value) of
+        the new tile.
+        """
+        empty_index = []
+        
+        for shift in range(0, 64, 4):
+            if not (self._board >> shift) & NIBBLE_MASK:
+                empty_index.append(shift)
+                
+        shift = self._rng.choice(empty_index)
+        
+        if self._rng.random() < 0.9:
+            self._board |= 1 << shift
+        else:
+            self._board |= 2 << shift
+        row, col = divmod(shift // 4, BITBOARD_SIZE)
+        return row, col, self.get_tile(row, col)
+
+    def set_tile(self, row, col, value):
+        """
+        Set the tile at position row, col to have the given value.
+        """
+        log = 0
+        if value:
+            log = value.bit_length() - 1
+            if value != 1 << log or log > MAX_TILE_LOG:
+                raise ValueError("tile value must be a power of two up to 32768")
+        shift = 4 * (row * BITBOARD_SIZE + col)
+        self._board = (self._board & ~(NIBBLE_MASK << shift)) | (log << shift)
+
+    def get_tile(self, row, col):
+        """
+        Return the value of the tile at position row, col.
+        """
+        log = (self._board >> (4 * (row * BITBOARD_SIZE + col))) & NIBBLE_MASK
+        if log:
+            return int(1 << log)
+        return 0
+
+
+class SearchTimeout(Exception):
+    """
+    Raised inside ExpectimaxPlayer when the time budget runs out.
+    """
+    pass
+
+
+class ExpectimaxPlayer:
+    """
+    Class that picks moves for a 2048 game with depth-limited
+    expectimax search over the tiles added by new_tile().
+    """
+
+    def __init__(self, max_depth=3, time_budget=0.1, table_size=100000,
+                 prob_cutoff=0.0001):
+        # search limits: depth in moves, seconds per move, probability
+        # below which a chance node is evaluated instead of expanded
+        self._max_depth = max_depth
+        self._time_budget = time_budget
+        self._prob_cutoff = prob_cutoff
+        
+        # transposition table of (board, depth) -> (value, low, high),
+        # evicting the least recently stored entries first once
+        # table_size is reached.
+        # With probability cutoffs a value only holds while the node is
+        # reached with a probability in [low, high): the same cutoffs
+        # are then taken in its subtree.
+        # _scale_low and _scale_high bound the factor by which the
+        # probability of the node being searched could be scaled
+        # without changing any cutoff taken so far.
+        self._scale_low = 0.0
+        self._scale_high = float("inf")
+        self._table_size = table_size
+        self._table = OrderedDict()
+        
+        self._deadline = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        """
+        Reset the search statistics.
+        """
+        self._nodes = 0
+        self._lookups = 0
+        self._hits = 0
+        self._search_time = 0.0
+        self._last_depth = 0
+
+    def get_stats(self):
+        """
+        Return a dictionary with the search statistics gathered since
+        the last reset_stats().
+        """
+        nodes_per_sec = 0.0
+        if self._search_time > 0:
+            nodes_per_sec = self._nodes / self._search_time
+        hit_rate = 0.0
+        if self._lookups:
+            hit_rate = self._hits / float(self._lookups)
+        return {"nodes": self._nodes,
+                "search_time": self._search_time,
+                "nodes_per_sec": nodes_per_sec,
+                "table_size": len(self._table),
+                "table_hit_rate": hit_rate,
+                "last_depth": self._last_depth}
+
+    def choose_move(self, game):
+        """
+        Return the best direction to move for the given game, or None
+        if no move changes the board.
+        """
+        height = game.get_grid_height()
+        width = game.get_grid_width()
+        board = tuple([game.get_tile(row, col)
+                       for row in range(height) for col in range(width)])
+        
+        start = time.time()
+        self._deadline = start + self._time_budget
+        best_move = None
+        
+        # iterative deepening, keeping the result of the deepest
+        # search that finished within the time budget
+        for depth in range(1, self._max_depth + 1):
+            self._scale_low = 0.0
+            self._scale_high = float("inf")
+            try:
+                value, move = self._max_node(board, height, width, depth, 1.0)
+            except SearchTimeout:
+                break
+            if move is None:
+                break
+            best_move = move
+            self._last_depth = depth
+        
+        # always return a legal move, even without a finished search
+        if best_move is None:
+            for direction in (UP, DOWN, LEFT, RIGHT):
+                if slide_board(board, height, width, direction)[0] != board:
+                    best_move = direction
+                    break
+        
+        self._search_time += time.time() - start
+        return best_move
+
+    def _max_node(self, board, height, width, depth, prob):
+        """
+        Return (value, direction) of the best move from board.
+        """
+        self._nodes += 1
+        best_value = None
+        best_move = None
+        for direction in (UP, DOWN, LEFT, RIGHT):
+            new_board, score = slide_board(board, height, width, direction)
+            if new_board == board:
+                continue
+            value = score + self._chance_node(new_board, height, width, depth - 1, prob)
+            if best_value is None or value > best_value:
+                best_value = value
+                best_move = direction
+        if best_value is None:
+            return 0.0, None
+        return best_value, best_move
+
+    def _chance_node(self, board, height, width, depth, prob):
+        """
+        Return the expected value of board over all new tiles.
+        """
+        self._nodes += 1
+        if not self._nodes % 256 and time.time() > self._deadline:
+            raise SearchTimeout()
+        
+        empty_index = [idx for idx in range(len(board)) if board[idx] == 0]
+        if depth == 0 or not empty_index:
+            return self.evaluate(board, width, len(empty_index))
+        if prob < self._prob_cutoff:
+            self._scale_high = min(self._scale_high, self._prob_cutoff / prob)
+            return self.evaluate(board, width, len(empty_index))
+        self._scale_low = max(self._scale_low, self._prob_cutoff / prob)
+        
+        key = (board, depth)
+        self._lookups += 1
+        if key in self._table:
+            value, low, high = self._table[key]
+            if low <= prob < high:
+                self._hits += 1
+                self._scale_low = max(self._scale_low, low / prob)
+                self._scale_high = min(self._scale_high, high / prob)
+                return value
+        
+        outer_low = self._scale_low
+        outer_high = self._scale_high
+        self._scale_low = self._prob_cutoff / prob
+        self._scale_high = float("inf")
+        total = 0.0
+        for idx in empty_index:
+            for value, tile_prob in ((2, 0.9), (4, 0.1)):
+                child_prob = prob * tile_prob / len(empty_index)
+                child = board[:idx] + (value,) + board[idx + 1:]
+                if child_prob < self._prob_cutoff:
+                    # unlikely spawn, not worth expanding
+                    self._scale_high = min(self._scale_high,
+                                           self._prob_cutoff / child_prob)
+                    total += tile_prob * self.evaluate(child, width,
+                                                       len(empty_index) - 1)
+                    continue
+                self._scale_low = max(self._scale_low,
+                                      self._prob_cutoff / child_prob)
+                total += tile_prob * self._max_node(child, height, width,
+                                                    depth, child_prob)[0]
+        total /= len(empty_index)
+        
+        self._store(key, (total, prob * self._scale_low, prob * self._scale_high))
+        self._scale_low = max(outer_low, self._scale_low)
+        self._scale_high = min(outer_high, self._scale_high)
+        return total
+
+    def _store(self, key, value):
+        """
+        Add an entry to the transposition table, evicting the least
+        recently stored one if the table is full.  A key stored again,
+        after a miss on its probability range, replaces its entry.
+        """
+        if not self._table_size:
+            return
+        if self._table.pop(key, None) is None:
+            if len(self._table) >= self._table_size:
+                self._table.popitem(False)
+        
+        # re-inserting moves the key to the most recently stored end
+        self._table[key] = value
+
+    def __call__(self, game, legal_moves, rng):
+        """
+        Policy interface used by play_game().
+        """
+        return self.choose_move(game)
+
+    def evaluate(self, board, width, num_empty):
+        """
+        Heuristic value of a board at the search horizon: empty
+        squares are worth a lot, and so is keeping the largest tile
+        in a corner.
+        """
+        value = 16.0 * num_empty
+        max_tile = max(board)
+        if max_tile in (board[0], board[width - 1], board[-width], board[-1]):
+            value += max_tile
+        return value
+
+
+# Binary game records.  A record file is a sequence of fixed-size
+# little-endian records (kind, small, medium, large):
+#   RECORD_GAME   starts a game: medium = height, large = width
+#   RECORD_TILE   a tile of the initial board: small = log2 value,
+#                 large = row-major cell index
+#   RECORD_MOVE   a move that changed the board: small = direction
+#   RECORD_SPAWN  the tile added after that move, encoded as RECORD_TILE
+
+RECORD_FORMAT = "<BBHI"
+RECORD_SIZE = 8
+RECORD_GAME = 0
+RECORD_TILE = 1
+RECORD_MOVE = 2
+RECORD_SPAWN = 3
+
+def log2_tile(value):
+    """
+    Function that returns the log2 of a tile value.
+    """
+    return value.bit_length() - 1
+
+
+class GameRecorder:
+    """
+    Class that appends the games played by a TwentyFortyEight engine
+    to a binary record file.
+    """
+
+    def __init__(self, path):
+        import struct
+        self._record = struct.Struct(RECORD_FORMAT)
+        self._file = open(path, "ab")
+        self._width = 0
+
+    def start_game(self, game):
+        """
+        Write the header and initial board of a game.
+        """
+        height = game.get_grid_height()
+        self._width = game.get_grid_width()
+        records = [self._record.pack(RECORD_GAME, 0, height, self._width)]
+        for row in range(height):
+            for col in range(self._width):
+                value = game.get_tile(row, col)
+                if value:
+                    records.append(self._record.pack(RECORD_TILE, log2_tile(value), 0,
+                                                     row * self._width + col))
+        self._file.write("".join(records))
+
+    def record_move(self, direction, spawn):
+        """
+        Write a move and the (row, col, value) tile added after it.
+        """
+        row, col, value = spawn
+        self._file.write(self._record.pack(RECORD_MOVE, direction, 0, 0) +
+                         self._record.pack(RECORD_SPAWN, log2_tile(value), 0,
+                                           row * self._width + col))
+
+    def close(self):
+        """
+        Flush and close the record file.
+        """
+        self._file.close()
+
+
+class GameReplay:
+    """
+    Class for one recorded game inside a memory-mapped record file.
+    """
+
+    def __init__(self, data, start, end):
+        import struct
+        self._record = struct.Struct(RECORD_FORMAT)
+        self._data = data
+        self._start = start
+        self._end = end
+        dummy_kind, dummy_small, self._grid_height, self._grid_width = \
+            self._record.unpack_from(data, start)
+
+    def get_grid_height(self):
+        """
+        Get the height of the board.
+        """
+        return self._grid_height
+
+    def get_grid_width(self):
+        """
+        Get the width of the board.
+        """
+        return self._grid_width
+
+    def __len__(self):
+        """
+        Return the number of recorded moves.
+        """
+        return len(self.moves())
+
+    def moves(self):
+        """
+        Return the list of recorded move directions.
+        """
+        return [small for kind, small, dummy_medium, dummy_large in
+                [self._record.unpack_from(self._data, offset)
+                 for offset in range(self._start + RECORD_SIZE, self._end, RECORD_SIZE)]
+                if kind == RECORD_MOVE]
+
+    def state_at(self, num_moves=None):
+        """
+        Return the board, as a flat row-major tuple, after the first
+        num_moves moves (all of them if num_moves is None).
+        """
+        height = self._grid_height
+        width = self._grid_width
+        packed = height == BITBOARD_SIZE and width == BITBOARD_SIZE
+        if packed:
+            build_row_tables()
+            board = 0
+        else:
+            board = [0] * (height * width)
+        
+        moves_done = 0
+        for offset in range(self._start + RECORD_SIZE, self._end, RECORD_SIZE):
+            kind, small, dummy_medium, large = self._record.unpack_from(self._data, offset)
+            if kind == RECORD_MOVE:
+                if moves_done == num_moves:
+                    break
+                moves_done += 1
+                if packed:
+                    board = move_board(board, small)
+                else:
+                    board = list(slide_board(tuple(board), height, width, small)[0])
+            elif packed:
+                board |= small << (4 * large)
+            else:
+                board[large] = 1 << small
+        
+        if packed:
+            logs = [(board >> shift) & NIBBLE_MASK for shift in range(0, 64, 4)]
+            return tuple([int(1 << log) if log else 0 for log in logs])
+        return tuple(board)
+
+
+class GameReplayer:
+    """
+    Class that memory-maps a record file written by GameRecorder and
+    gives lazy access to the games in it.
+    """
+
+    def __init__(self, path):
+        import mmap
+        self._file = open(path, "rb")
+        self._file.seek(0, 2)
+        if self._file.tell():
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # an empty file cannot be mapped
+            self._data = ""
+        self._offsets = None
+
+    def _game_offsets(self):
+        """
+        Return the offsets of the game headers, scanning the file
+        the first time.
+        """
+        if self._offsets is None:
+            game_kind = chr(RECORD_GAME)
+            self._offsets = [offset for offset in
+                             range(0, len(self._data), RECORD_SIZE)
+                             if self._data[offset] == game_kind]
+        return self._offsets
+
+    def __len__(self):
+        """
+        Return the number of recorded games.
+        """
+        return len(self._game_offsets())
+
+    def game(self, index):
+        """
+        Return the GameReplay of the game with the given index.
+        """
+        offsets = self._game_offsets()
+        end = len(self._data)
+        if index + 1 < len(offsets):
+            end = offsets[index + 1]
+        return GameReplay(self._data, offsets[index], end)
+
+    def __iter__(self):
+        """
+        Iterate over all games, scanning the file as it goes.
+        """
+        game_kind = chr(RECORD_GAME)
+        start = None
+        for offset in range(0, len(self._data), RECORD_SIZE):
+            if self._data[offset] == game_kind:
+                if start is not None:
+                    yield GameReplay(self._data, start, offset)
+                start = offset
+        if start is not None:
+            yield GameReplay(self._data, start, len(self._data))
+
+    def close(self):
+        """
+        Unmap and close the record file.
+        """
+        if self._data:
+            self._data.close()
+        self._file.close()
+
+
+# Headless self-play.  A policy is any picklable callable taking
+# (game, legal_moves, rng) and returning one of legal_moves.
+
+def random_policy(game, legal_moves, rng):
+    """
+    Policy that picks a uniformly random legal move.
+    """
+    return rng.choice(legal_moves)
+
+def play_game(policy, seed, grid_height=4, grid_width=4):
+    """
+    Function that plays one complete game with the given policy,
+    using its own random.Random(seed) for both the tiles and the
+    policy.  The bitboard engine is used for 4x4 boards.
+
+    Returns a dictionary with the final score, max tile and number
+    of moves.
+    """
+    rng = random.Random(seed)
+    if grid_height == BITBOARD_SIZE and grid_width == BITBOARD_SIZE:
+        game = TwentyFortyEightBitboard(rng)
+    else:
+        game = TwentyFortyEight(grid_height, grid_width, rng)
+    
+    score = 0
+    num_moves = 0
+    while True:
+        slides = {}
+        if isinstance(game, TwentyFortyEightBitboard):
+            board = game.get_board()
+            for direction in (UP, DOWN, LEFT, RIGHT):
+                if move_board(board, direction) != board:
+                    slides[direction] = board_move_score(board, direction)
+        else:
+            board = tuple([game.get_tile(row, col)
+                           for row in range(grid_height) for col in range(grid_width)])
+            for direction in (UP, DOWN, LEFT, RIGHT):
+                new_board, move_score = slide_board(board, grid_height, grid_width, direction)
+                if new_board != board:
+                    slides[direction] = move_score
+        if not slides:
+            break
+        
+        direction = policy(game, sorted(slides), rng)
+        game.move(direction)
+        score += slides[direction]
+        num_moves += 1
+    
+    return {"seed": seed,
+            "score": score,
+            "max_tile": max([game.get_tile(row, col)
+                             for row in range(grid_height) for col in range(grid_width)]),
+            "moves": num_moves}
+
+def _play_game_args(args):
+    """
+    Unpack the arguments of play_game() for process pools.
+    """
+    return play_game(*args)
+
+def run_self_play(num_games, policy=random_policy, grid_height=4, grid_width=4,
+                  processes=1, seed=0):
+    """
+    Function that plays num_games games without a GUI, game idx being
+    seeded with seed + idx, so results do not depend on the number of
+    processes.  With processes > 1 the games are spread over a
+    multiprocessing pool.
+
+    Returns a tuple (results, summary) where results holds the
+    play_game() dictionary of every game and summary aggregates
+    throughput in games/sec and moves/sec.
+    """
+    jobs = [(policy, seed + idx, grid_height, grid_width)
+            for idx in range(num_games)]
+    
+    start = time.time()
+    if processes > 1:
+        # multiprocessing is not available in CodeSkulptor, so only
+        # import it when a pool is asked for
+        import multiprocessing
+        pool = multiprocessing.Pool(processes)
+        try:
+            chunk_size = max(1, num_games // (4 * processes))
+            results = pool.map(_play_game_args, jobs, chunk_size)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_play_game_args(job) for job in jobs]
+    elapsed = max(time.time() - start, 1e-9)
+    
+    total_moves = sum([result["moves"] for result in results])
+    summary = {"games": num_games,
+               "moves": total_moves,
+               "elapsed": elapsed,
+               "games_per_sec": num_games / elapsed,
+               "moves_per_sec": total_moves / elapsed,
+               "mean_score": sum([result["score"] for result in results]) / float(max(num_games, 1)),
+               "max_tile": max([result["max_tile"] for result in results] + [0])}
+    return results, summary
+
+def check_expectimax_table(num_games=20, num_moves=30, table_size=50,
+                           prob_cutoff=0.01):
+    """
+    Regression check for the ExpectimaxPlayer transposition table.
+    Plays the first num_moves moves of num_games seeded games with a
+    tiny table, so that entries are stored again after probability
+    range misses and evicted all the time, and checks that the table
+    never outgrows table_size.
+
+    Returns the number of moves played.
+    """
+    num_played = 0
+    for seed in range(num_games):
+        game = TwentyFortyEightBitboard(random.Random(seed))
+        player = ExpectimaxPlayer(max_depth=3, time_budget=100,
+                                  table_size=table_size, prob_cutoff=prob_cutoff)
+        for dummy_move in range(num_moves):
+            direction = player.choose_move(game)
+            if direction is None:
+                break
+            game.move(direction)
+            num_played += 1
+            assert player.get_stats()["table_size"] <= table_size
+    return num_played
+
+
+if __name__ == "__main__":
+    poc_2048_gui.run_gui(TwentyFortyEight(5, 6))
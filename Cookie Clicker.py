@@ -4,6 +4,9 @@ Cookie Clicker Simulator
  
 import simpleplot
 import math
+import random
+import time as timer
+from bisect import bisect_left, bisect_right
  
 # Used to increase the timeout, if necessary
 import codeskulptor
@@ -15,22 +18,295 @@ import poc_clicker_provided as provided
 # Constants
 SIM_TIME = 10000000000.0
  
+ 
+def new_column(typecode):
+    """
+    Return an empty history column: an array with the given typecode,
+    or a plain list in CodeSkulptor, which has no array module
+    """
+    try:
+        from array import array
+    except ImportError:
+        return []
+    return array(typecode)
+ 
+ 
+class HistoryStore:
+    """
+    Append-only store for the history of a game.  Each field of the
+    (time, item, cost of item, total cookies) records is kept in its
+    own compact column, item names as indices into a name table.
+    """
+    def __init__(self):
+        self._times = new_column('d')
+        self._items = new_column('i')
+        self._costs = new_column('d')
+        self._totals = new_column('d')
+        self._item_names = []
+        self._item_ids = {}
+ 
+    def __len__(self):
+        """
+        Return number of records
+        """
+        return len(self._times)
+ 
+    def append(self, record):
+        """
+        Add a (time, item, cost of item, total cookies) record
+        """
+        time, item, cost, total = record
+        if item is None:
+            item_id = -1
+        else:
+            item_id = self._item_ids.get(item)
+            if item_id is None:
+                item_id = len(self._item_names)
+                self._item_ids[item] = item_id
+                self._item_names.append(item)
+        self._times.append(time)
+        self._items.append(item_id)
+        self._costs.append(cost)
+        self._totals.append(total)
+ 
+    def record(self, idx):
+        """
+        Return record idx as a tuple
+        """
+        item_id = self._items[idx]
+        if item_id < 0:
+            item = None
+        else:
+            item = self._item_names[item_id]
+        return (self._times[idx], item, self._costs[idx], self._totals[idx])
+ 
+    def to_list(self, length=None):
+        """
+        Return a list with the first length records (all of them if
+        length is None)
+        """
+        if length is None:
+            length = len(self)
+        return [self.record(idx) for idx in range(length)]
+ 
+    def records(self, length):
+        """
+        Iterate over the first length records
+        """
+        for idx in range(length):
+            yield self.record(idx)
+ 
+    def series(self):
+        """
+        Return the (time, total cookies) points of every record, e.g.
+        for simpleplot.plot_lines
+        """
+        return zip(self._times, self._totals)
+ 
+    def copy(self):
+        """
+        Return an independent copy of the store
+        """
+        store = HistoryStore()
+        store._times = self._times[:]
+        store._items = self._items[:]
+        store._costs = self._costs[:]
+        store._totals = self._totals[:]
+        store._item_names = list(self._item_names)
+        store._item_ids = dict(self._item_ids)
+        return store
+ 
+ 
+class StreamingHistory:
+    """
+    History sink for long runs.  Every record is written to a file
+    as soon as it is appended, and only the latest keep records plus
+    a downsampled (time, total cookies) series are kept in memory, so
+    memory stays bounded however long the simulation runs.  Older
+    records are read back from the file when asked for.
+ 
+    The series keeps a point each time the time grows by factor, so
+    points are spaced logarithmically in time.  When it reaches
+    max_points, every other point is dropped and factor squared.
+    """
+    def __init__(self, path, factor=1.01, max_points=1000, keep=64):
+        self._path = path
+        self._file = open(path, 'w')
+        self._factor = factor
+        self._max_points = max_points
+        self._keep = max(keep, 1)
+        self._length = 0
+        self._recent = []
+        self._points = []
+        self._next_time = 0.0
+ 
+    def __len__(self):
+        """
+        Return number of records
+        """
+        return self._length
+ 
+    def append(self, record):
+        """
+        Write a (time, item, cost of item, total cookies) record
+        """
+        time, item, cost, total = record
+        if item is None:
+            item = ''
+        self._file.write(repr(time) + ',' + str(item) + ',' + repr(cost) + ',' + repr(total) + '\n')
+        self._length += 1
+        self._recent.append(record)
+        if len(self._recent) > 2 * self._keep:
+            self._recent = self._recent[-self._keep:]
+        if time >= self._next_time:
+            self._points.append((time, total))
+            if len(self._points) >= self._max_points:
+                self._points = self._points[::2]
+                self._factor *= self._factor
+            self._next_time = time * self._factor
+ 
+    def record(self, idx):
+        """
+        Return record idx as a tuple.  Records older than the ones
+        kept in memory are read back from the file, which takes time
+        proportional to idx.
+        """
+        if idx < 0:
+            idx += self._length
+        if not 0 <= idx < self._length:
+            raise IndexError("history index out of range")
+        first_recent = self._length - len(self._recent)
+        if idx >= first_recent:
+            return self._recent[idx - first_recent]
+        for pos, record in enumerate(self.records(idx + 1)):
+            if pos == idx:
+                return record
+ 
+    def records(self, length):
+        """
+        Iterate over the first length records, read from the file
+        """
+        if not self._file.closed:
+            self._file.flush()
+        history_file = open(self._path)
+        try:
+            for dummy_idx in range(length):
+                time, rest = history_file.readline().split(',', 1)
+                item, cost, total = rest.rsplit(',', 2)
+                if not item:
+                    item = None
+                yield (float(time), item, float(cost), float(total))
+        finally:
+            history_file.close()
+ 
+    def to_list(self, length=None):
+        """
+        Return a list with the first length records (all of them if
+        length is None), read from the file
+        """
+        if length is None:
+            length = self._length
+        return list(self.records(length))
+ 
+    def copy(self):
+        """
+        A streamed history cannot be copied: the states to copy,
+        checkpoint or branch need a HistoryStore
+        """
+        raise TypeError("a StreamingHistory cannot be copied, use a HistoryStore")
+ 
+    def series(self):
+        """
+        Return the downsampled (time, total cookies) points, ending
+        with the latest record, e.g. for simpleplot.plot_lines
+        """
+        points = list(self._points)
+        if self._recent and points[-1][0] != self._recent[-1][0]:
+            points.append((self._recent[-1][0], self._recent[-1][3]))
+        return points
+ 
+    def close(self):
+        """
+        Close the history file
+        """
+        self._file.close()
+ 
+ 
+class HistoryView:
+    """
+    Read-only view of the first records of a HistoryStore.  Since the
+    store is append-only, the view never changes and costs nothing
+    to create.
+    """
+    def __init__(self, store, length):
+        self._store = store
+        self._length = length
+ 
+    def __len__(self):
+        """
+        Return number of records in the view
+        """
+        return self._length
+ 
+    def __getitem__(self, idx):
+        """
+        Return a record, or a list of records for a slice
+        """
+        if isinstance(idx, slice):
+            return [self._store.record(pos) for pos in range(*idx.indices(self._length))]
+        if idx < 0:
+            idx += self._length
+        if not 0 <= idx < self._length:
+            raise IndexError("history index out of range")
+        return self._store.record(idx)
+ 
+    def __iter__(self):
+        """
+        Iterate over the records in the view
+        """
+        return self._store.records(self._length)
+ 
+    def __str__(self):
+        """
+        Return the records as a list
+        """
+        return str(self._store.to_list(self._length))
+ 
+ 
 class ClickerState:
     """
     Simple class to keep track of the game state.
+ 
+    history is where the history records go: a new HistoryStore by
+    default, or e.g. a StreamingHistory.
     """
-    def __init__(self):
+    def __init__(self, history=None):
         self._running_time = 0.0
         self._current_cookies = 0.0
         self._total_cookies = 0.0
         self._cps = 1.0
-        self._history = [(0.0,None,0.0,0.0)]
+        if history is None:
+            history = HistoryStore()
+        self._history = history
+        self._history.append((0.0,None,0.0,0.0))
          
     def __str__(self):
         """
         Return human readable state
         """
-        return 'Time: ' + str(self.get_time()) + ' Current cookies: ' + str(self._current_cookies) + ' CPS:' + str(self._cps) + ' Total cookies: ' + str(self._total_cookies) + ' History (length: ' + str(len(self._history)) + '): ' + str(self._history)
+        return 'Time: ' + str(self.get_time()) + ' Current cookies: ' + str(self._current_cookies) + ' CPS:' + str(self._cps) + ' Total cookies: ' + str(self._total_cookies) + ' History (length: ' + str(len(self._history)) + '): ' + str(self._history.to_list())
+         
+    def copy(self):
+        """
+        Return an independent copy of the state, history included
+        """
+        state = ClickerState()
+        state._running_time = self._running_time
+        state._current_cookies = self._current_cookies
+        state._total_cookies = self._total_cookies
+        state._cps = self._cps
+        state._history = self._history.copy()
+        return state
          
     def get_cookies(self):
         """
@@ -41,6 +317,14 @@ class ClickerState:
         """
         return self._current_cookies
      
+    def get_total_cookies(self):
+        """
+        Return total number of cookies made so far
+ 
+        Should return a float
+        """
+        return self._total_cookies
+ 
     def get_cps(self):
         """
         Get current CPS
@@ -69,7 +353,16 @@ class ClickerState:
         Should return a copy of any internal data structures,
         so that they will not be modified outside of the class.
         """
-        return self._history[:]
+        return self._history.to_list()
+ 
+    def get_history_view(self):
+        """
+        Return a read-only view of the history
+ 
+        The view supports len(), indexing and iteration like the
+        list from get_history(), without copying the history.
+        """
+        return HistoryView(self._history, len(self._history))
  
     def time_until(self, cookies):
         """
@@ -104,39 +397,592 @@ class ClickerState:
             self._cps += additional_cps
     
      
-def simulate_clicker(build_info, duration, strategy):
+class RatioNode:
+    """
+    Node of a RatioTree
+    """
+    def __init__(self, cost, item, ratio):
+        self.key = (cost, item)
+        self.value = (ratio, item)
+        self.best = self.value
+        self.priority = random.random()
+        self.left = None
+        self.right = None
+ 
+    def update(self):
+        """
+        Recompute the best (ratio, item) of the subtree
+        """
+        self.best = self.value
+        if self.left is not None and self.left.best > self.best:
+            self.best = self.left.best
+        if self.right is not None and self.right.best > self.best:
+            self.best = self.right.best
+ 
+ 
+class RatioTree:
+    """
+    Treap of items ordered by (cost, item), where each node also
+    keeps the best (cps/cost ratio, item) of its subtree.  The best
+    ratio among the items costing at most a budget is then the best
+    of the subtrees left of one root-to-leaf path, so inserts,
+    removals and queries are all O(log n) expected.
+    """
+    def __init__(self):
+        self._root = None
+ 
+    def insert(self, cost, item, ratio):
+        """
+        Add item with the given cost and cps/cost ratio
+        """
+        self._root = self._insert(self._root, RatioNode(cost, item, ratio))
+ 
+    def _insert(self, node, new_node):
+        """
+        Insert new_node in the subtree of node and return its new root
+        """
+        if node is None:
+            return new_node
+        if new_node.priority > node.priority:
+            new_node.left, new_node.right = self._split(node, new_node.key)
+            new_node.update()
+            return new_node
+        if new_node.key < node.key:
+            node.left = self._insert(node.left, new_node)
+        else:
+            node.right = self._insert(node.right, new_node)
+        node.update()
+        return node
+ 
+    def _split(self, node, key):
+        """
+        Split the subtree of node into the keys below key and the rest
+        """
+        if node is None:
+            return None, None
+        if node.key < key:
+            node.right, rest = self._split(node.right, key)
+            node.update()
+            return node, rest
+        below, node.left = self._split(node.left, key)
+        node.update()
+        return below, node
+ 
+    def remove(self, cost, item):
+        """
+        Take out item, which must have been inserted with cost
+        """
+        self._root = self._remove(self._root, (cost, item))
+ 
+    def _remove(self, node, key):
+        """
+        Remove key from the subtree of node and return its new root
+        """
+        if node.key == key:
+            return self._merge(node.left, node.right)
+        if key < node.key:
+            node.left = self._remove(node.left, key)
+        else:
+            node.right = self._remove(node.right, key)
+        node.update()
+        return node
+ 
+    def _merge(self, left, right):
+        """
+        Join two subtrees, all keys of left being below those of right
+        """
+        if left is None:
+            return right
+        if right is None:
+            return left
+        if left.priority > right.priority:
+            left.right = self._merge(left.right, right)
+            left.update()
+            return left
+        right.left = self._merge(left, right.left)
+        right.update()
+        return right
+ 
+    def best_up_to(self, budget):
+        """
+        Return the item with the best cps/cost ratio among those
+        costing at most budget, or None
+        """
+        best = None
+        node = self._root
+        while node is not None:
+            if node.key[0] <= budget:
+                if node.left is not None and (best is None or node.left.best > best):
+                    best = node.left.best
+                if best is None or node.value > best:
+                    best = node.value
+                node = node.right
+            else:
+                node = node.left
+        if best is None:
+            return None
+        return best[1]
+ 
+ 
+class IndexedBuildInfo:
+    """
+    Wrapper around a BuildInfo that keeps its items ranked by cost,
+    and in a RatioTree for cps/cost, so strategies do not sort every
+    item on every call.  update_item only re-ranks the item bought:
+    binary searches and O(log n) tree updates, but inserting into and
+    deleting from the sorted cost lists moves O(n) entries (a memmove,
+    cheap even for thousands of items).  The queries are O(1) or
+    O(log n).
+    """
+    def __init__(self, build_info):
+        self._info = build_info
+        self._growth = {}
+        self._by_cost = []
+        self._cost_keys = []
+        self._ratios = RatioTree()
+        for item in build_info.build_items():
+            self._add(item)
+ 
+    def _add(self, item):
+        """
+        Insert item in the rankings
+        """
+        cost = self._info.get_cost(item)
+        pos = bisect_right(self._by_cost, (cost, item))
+        self._by_cost.insert(pos, (cost, item))
+        self._cost_keys.insert(pos, cost)
+        self._ratios.insert(cost, item, self._info.get_cps(item) / cost)
+ 
+    def _remove(self, item):
+        """
+        Take item out of the rankings
+        """
+        cost = self._info.get_cost(item)
+        pos = bisect_left(self._by_cost, (cost, item))
+        del self._by_cost[pos]
+        del self._cost_keys[pos]
+        self._ratios.remove(cost, item)
+ 
+    def build_items(self):
+        """
+        Return the items of the wrapped BuildInfo
+        """
+        return self._info.build_items()
+ 
+    def get_cost(self, item):
+        """
+        Return the current cost of item
+        """
+        return self._info.get_cost(item)
+ 
+    def get_cps(self, item):
+        """
+        Return the cps of item
+        """
+        return self._info.get_cps(item)
+ 
+    def update_item(self, item):
+        """
+        Update the cost of item after buying it
+        """
+        self._remove(item)
+        self._info.update_item(item)
+        self._add(item)
+ 
+    def clone(self):
+        """
+        Return an indexed copy of the wrapped BuildInfo
+        """
+        return IndexedBuildInfo(self._info.clone())
+ 
+    def cheapest_affordable(self, budget):
+        """
+        Return the cheapest item, if it costs at most budget
+        """
+        if self._by_cost and self._by_cost[0][0] <= budget:
+            return self._by_cost[0][1]
+        return None
+ 
+    def most_expensive_affordable(self, budget):
+        """
+        Return the most expensive item costing at most budget
+        """
+        pos = bisect_right(self._cost_keys, budget)
+        if pos:
+            return self._by_cost[pos - 1][1]
+        return None
+ 
+    def get_growth(self, item):
+        """
+        Return the factor by which the cost of item grows with each
+        purchase, measured once on a clone of the BuildInfo
+        """
+        if item not in self._growth:
+            probe = self._info.clone()
+            cost = probe.get_cost(item)
+            probe.update_item(item)
+            self._growth[item] = probe.get_cost(item) / cost
+        return self._growth[item]
+ 
+    def purchases_while_cheapest(self, item):
+        """
+        Return how many times in a row the cheapest item, item, can
+        be bought while it stays the cheapest, from the geometric
+        growth of its cost (None if it always does).  The count errs
+        on the low side: the last purchase is left to the strategy
+        """
+        if len(self._by_cost) < 2 or self.get_growth(item) <= 1:
+            return None
+        ratio = self._by_cost[1][0] / self.get_cost(item)
+        return max(1, int(math.log(ratio) / math.log(self.get_growth(item))))
+ 
+    def best_ratio_affordable(self, budget):
+        """
+        Return the item with the best cps/cost ratio among those
+        costing at most budget
+        """
+        return self._ratios.best_up_to(budget)
+ 
+ 
+def item_index(build_info):
+    """
+    Return build_info as an IndexedBuildInfo, wrapping it if needed
+    """
+    if isinstance(build_info, IndexedBuildInfo):
+        return build_info
+    return IndexedBuildInfo(build_info)
+ 
+ 
+class PurchaseRun:
+    """
+    Strategy answer meaning "buy item count more times in a row"
+    (as long as time allows if count is None).  simulate_clicker
+    then buys the whole run without calling the strategy again.
+ 
+    condition, if given, is called like a strategy before every
+    purchase but the first and ends the run, handing control back
+    to the strategy, when it returns False.
+    """
+    def __init__(self, item, count=None, condition=None):
+        if count is not None and count < 1:
+            raise ValueError("a purchase run needs a positive count")
+        self.item = item
+        self.count = count
+        self.condition = condition
+ 
+ 
+def still_affordable(item):
+    """
+    Return a PurchaseRun condition that holds while item costs at
+    most the cookies that can be made in the time left, the test
+    the strategies use
+    """
+    def condition(cookies, cps, dummy_history, time_left, build_info):
+        """
+        Check whether item is still affordable in the time left
+        """
+        return build_info.get_cost(item) <= cookies + cps*time_left
+    return condition
+ 
+ 
+def buy_once(clicker, info, item, time_left):
+    """
+    Wait for and buy one item, as the main loop of simulate_clicker
+    does.  Returns False, after waiting out time_left, if the item
+    cannot be afforded in time.
+    """
+    cost = info.get_cost(item)
+    wait_time = clicker.time_until(cost)
+    if wait_time>time_left:
+        clicker.wait(time_left)
+        return False
+    clicker.wait(wait_time)
+    additional_cps = info.get_cps(item)
+    clicker.buy_item(item, cost, additional_cps)
+    info.update_item(item)
+    return True
+ 
+ 
+def buy_run(clicker, info, run, duration):
+    """
+    Buy the items of a PurchaseRun exactly like the main loop of
+    simulate_clicker would, one purchase after the other.  Returns
+    False if the simulation ran out of time.
+    """
+    bought = 0
+    while run.count is None or bought < run.count:
+        time_left = duration - clicker.get_time()
+        if time_left<0:
+            break
+        if bought and run.condition is not None and \
+                not run.condition(clicker.get_cookies(), clicker.get_cps(),
+                                  clicker.get_history_view(), time_left, info):
+            break
+        if not buy_once(clicker, info, run.item, time_left):
+            return False
+        bought += 1
+    return True
+ 
+ 
+class SimulationProfile:
+    """
+    Collects timings and counters for one simulate_clicker run.
+    Pass an instance as the profile argument of simulate_clicker;
+    without one the simulator runs uninstrumented.
+    """
+    PHASES = ("strategy", "wait", "buy", "update_item")
+ 
+    def __init__(self):
+        self._phase_calls = dict([(phase, 0) for phase in self.PHASES])
+        self._phase_time = dict([(phase, 0.0) for phase in self.PHASES])
+        self._history_growth = []
+        self._next_sample = 1
+        self._start = None
+        self._wall_time = 0.0
+        self._history_length = 0
+        self._peak_memory = None
+ 
+    def add(self, phase, seconds):
+        """
+        Record one call of a phase that took seconds
+        """
+        self._phase_calls[phase] += 1
+        self._phase_time[phase] += seconds
+ 
+    def history_grew(self, time, length):
+        """
+        Record the history length, sampled each time it doubles
+        """
+        if length >= self._next_sample:
+            self._history_growth.append((time, length))
+            self._next_sample = 2 * length
+ 
+    def start_run(self):
+        """
+        Mark the start of the simulation
+        """
+        self._start = timer.time()
+ 
+    def finish_run(self, clicker):
+        """
+        Mark the end of the simulation of clicker
+        """
+        self._wall_time = timer.time() - self._start
+        self._history_length = len(clicker.get_history_view())
+        self._history_growth.append((clicker.get_time(), self._history_length))
+        try:
+            # not available everywhere, e.g. CodeSkulptor and Windows
+            import resource
+            self._peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        except ImportError:
+            self._peak_memory = None
+ 
+    def report(self):
+        """
+        Return the collected data as a dictionary
+        """
+        phases = {}
+        for phase in self.PHASES:
+            phases[phase] = {"calls": self._phase_calls[phase],
+                             "seconds": self._phase_time[phase]}
+        return {"wall_time": self._wall_time,
+                "iterations": self._phase_calls["strategy"],
+                "phases": phases,
+                "history_length": self._history_length,
+                "history_growth": list(self._history_growth),
+                "peak_memory_kb": self._peak_memory}
+ 
+ 
+class ProfiledClickerState(ClickerState):
+    """
+    ClickerState that times wait and buy_item into a
+    SimulationProfile
+    """
+    def __init__(self, profile, history=None):
+        ClickerState.__init__(self, history)
+        self._profile = profile
+ 
+    def wait(self, time):
+        """
+        Wait for given amount of time and update state
+        """
+        start = timer.time()
+        ClickerState.wait(self, time)
+        self._profile.add("wait", timer.time() - start)
+ 
+    def buy_item(self, item_name, cost, additional_cps):
+        """
+        Buy an item and update state
+        """
+        start = timer.time()
+        ClickerState.buy_item(self, item_name, cost, additional_cps)
+        self._profile.add("buy", timer.time() - start)
+        self._profile.history_grew(self.get_time(), len(self._history))
+ 
+ 
+class ProfiledBuildInfo(IndexedBuildInfo):
+    """
+    IndexedBuildInfo that times update_item into a SimulationProfile
+    """
+    def __init__(self, build_info, profile):
+        IndexedBuildInfo.__init__(self, build_info)
+        self._profile = profile
+ 
+    def update_item(self, item):
+        """
+        Update the cost of item after buying it
+        """
+        start = timer.time()
+        IndexedBuildInfo.update_item(self, item)
+        self._profile.add("update_item", timer.time() - start)
+ 
+ 
+def profile_strategy(strategy, profile):
+    """
+    Return strategy wrapped to time its calls into profile
+    """
+    def timed_strategy(cookies, cps, history, time_left, build_info):
+        """
+        Call the strategy and record how long it took
+        """
+        start = timer.time()
+        item = strategy(cookies, cps, history, time_left, build_info)
+        profile.add("strategy", timer.time() - start)
+        return item
+    return timed_strategy
+ 
+ 
+def simulate_clicker(build_info, duration, strategy, profile=None, history=None):
     """
     Function to run a Cookie Clicker game for the given
     duration with the given strategy.  Returns a ClickerState
     object corresponding to the final state of the game.
+ 
+    The strategy may also return a PurchaseRun to buy the same
+    item several times without being asked in between.
+ 
+    If a SimulationProfile is given, the run is instrumented and
+    the profile filled in; otherwise nothing is measured.
+ 
+    history is passed on to ClickerState, e.g. a StreamingHistory
+    to keep memory bounded on long runs.
     """
  
-    info = build_info.clone()
-    clicker = ClickerState()
+    if profile is None:
+        info = IndexedBuildInfo(build_info.clone())
+        clicker = ClickerState(history)
+    else:
+        info = ProfiledBuildInfo(build_info.clone(), profile)
+        clicker = ProfiledClickerState(profile, history)
+        strategy = profile_strategy(strategy, profile)
+        profile.start_run()
+    run_clicker(clicker, info, duration, strategy)
+    if profile is not None:
+        profile.finish_run(clicker)
+    return clicker
+ 
+ 
+def run_clicker(clicker, info, duration, strategy):
+    """
+    Run the game in clicker, buying from info, with the given
+    strategy until duration.  This is the main loop of
+    simulate_clicker, which also serves to resume checkpoints.
+    """
     while True:
         time_left = duration - clicker.get_time()
         if time_left<0:
             break
-        item = strategy(clicker.get_cookies(), clicker.get_cps(), clicker.get_history(), time_left, info)
+        item = strategy(clicker.get_cookies(), clicker.get_cps(), clicker.get_history_view(), time_left, info)
         if not item:
             # print "No item to buy"
             clicker.wait(time_left)
             break
-        cost = info.get_cost(item)
-        # print "Want to buy item: " + item + ", cost: " + str(cost)
-        wait_time = clicker.time_until(cost)
-        # print "Need to wait " + str(wait_time) + " seconds"
-        if wait_time>time_left:
+        if isinstance(item, PurchaseRun):
+            if not buy_run(clicker, info, item, duration):
+                break
+        elif not buy_once(clicker, info, item, time_left):
             # print "Not enough time to wait"
-            clicker.wait(time_left)
             break
-        clicker.wait(wait_time)
-        additional_cps = info.get_cps(item) 
-        clicker.buy_item(item, cost, additional_cps)
-        info.update_item(item)
-    return clicker
  
  
+class ClickerCheckpoint:
+    """
+    Saved copy of a running simulation: the ClickerState and the
+    BuildInfo it buys from.  A checkpoint can be resumed any number
+    of times, with different strategies.  It needs the state to keep
+    its history in a HistoryStore.
+    """
+    def __init__(self, clicker, info):
+        self._clicker = clicker.copy()
+        self._info = info.clone()
+ 
+    def restore(self):
+        """
+        Return fresh copies of the saved (clicker, info)
+        """
+        return self._clicker.copy(), self._info.clone()
+ 
+    def resume(self, duration, strategy):
+        """
+        Continue the saved simulation up to duration with strategy
+        and return the final ClickerState
+        """
+        clicker, info = self.restore()
+        run_clicker(clicker, info, duration, strategy)
+        return clicker
+ 
+ 
+def simulate_variants(build_info, duration, variants):
+    """
+    Simulate strategy variants that start with fixed purchase
+    prefixes.  variants is a list of (name, prefix, strategy), where
+    prefix is a list of items bought first and strategy takes over
+    afterwards, exactly as if the strategy had returned the prefix
+    items itself.
+ 
+    The prefixes are organised as a prefix tree, so purchases shared
+    by several variants are simulated once and the state is
+    checkpointed where they diverge.
+ 
+    Returns a dictionary from variant name to final ClickerState.
+    """
+    # node: [variants whose prefix ends here, {item: child node}]
+    root = [[], {}]
+    for name, prefix, strategy in variants:
+        node = root
+        for item in prefix:
+            node = node[1].setdefault(item, [[], {}])
+        node[0].append((name, strategy))
+ 
+    results = {}
+    def finish(node, clicker):
+        """
+        Give every variant below node the final state clicker, once
+        time has run out during a shared prefix
+        """
+        for name, dummy_strategy in node[0]:
+            results[name] = clicker.copy()
+        for child in node[1].values():
+            finish(child, clicker)
+ 
+    # depth-first, the last branch of a node reusing its state
+    stack = [(root, ClickerState(), IndexedBuildInfo(build_info.clone()))]
+    while stack:
+        node, clicker, info = stack.pop()
+        for name, strategy in node[0]:
+            results[name] = ClickerCheckpoint(clicker, info).resume(duration, strategy)
+        children = node[1].items()
+        for idx in range(len(children)):
+            item, child = children[idx]
+            if idx < len(children) - 1:
+                child_clicker, child_info = clicker.copy(), info.clone()
+            else:
+                child_clicker, child_info = clicker, info
+            if buy_run(child_clicker, child_info, PurchaseRun(item, 1), duration):
+                stack.append((child, child_clicker, child_info))
+            else:
+                finish(child, child_clicker)
+    return results
  
  
 def strategy_cursor_broken(cookies, cps, history, time_left, build_info):
@@ -166,27 +1012,29 @@ def strategy_cheap(cookies, cps, history, time_left, build_info):
     Always buy the cheapest item you can afford in the time left.
     """
     future_cookies = cookies + cps*time_left
-    items = build_info.build_items()
-    costs = [build_info.get_cost(item) for item in items]
-    sorted_items = sorted(zip(costs,items))
-    for item in sorted_items:
-        if future_cookies>=item[0]:
-            return item[1]
-    return None
+    return item_index(build_info).cheapest_affordable(future_cookies)
      
  
+def strategy_cheap_runs(cookies, cps, history, time_left, build_info):
+    """
+    strategy_cheap answering with PurchaseRuns: the cheapest item is
+    bought as many times in a row as it stays the cheapest, so the
+    strategy is not asked in between.  Same results as strategy_cheap.
+    """
+    index = item_index(build_info)
+    item = index.cheapest_affordable(cookies + cps*time_left)
+    if item is None:
+        return None
+    return PurchaseRun(item, index.purchases_while_cheapest(item),
+                       still_affordable(item))
+ 
+ 
 def strategy_expensive(cookies, cps, history, time_left, build_info):
     """
     Always buy the most expensive item you can afford in the time left.
     """
     future_cookies = cookies + cps*time_left
-    items = build_info.build_items()
-    costs = [build_info.get_cost(item) for item in items]
-    sorted_items = sorted(zip(costs,items), reverse=True)
-    for item in sorted_items:
-        if future_cookies>=item[0]:
-            return item[1]
-    return None
+    return item_index(build_info).most_expensive_affordable(future_cookies)
  
  
 def strategy_best(cookies, cps, history, time_left, build_info):
@@ -194,22 +1042,344 @@ def strategy_best(cookies, cps, history, time_left, build_info):
     The best strategy that you are able to implement.
     """
     future_cookies = cookies + cps*time_left
-    items = build_info.build_items()
-    costs = [build_info.get_cost(item) for item in items]
-    cpss = [build_info.get_cps(item) for item in items]
-    cps_rate = [cpss[idx]/costs[idx] for idx in range(len(items))]
-    sorted_items = sorted(zip(cps_rate, items, costs), reverse=True)
-    for item in sorted_items:
-        if future_cookies>=item[2]:
-            return item[1]
-    return None
+    return item_index(build_info).best_ratio_affordable(future_cookies)
      
-         
-def run_strategy(strategy_name, time, strategy):
+
+ 
+class PlanStrategy:
+    """
+    Strategy that buys a fixed sequence of items, then nothing.
+    Made by plan_optimal, so that the plan can be handed to
+    simulate_clicker like any other strategy.
+    """
+    def __init__(self, items, total_cookies, optimal, nodes):
+        self.items = list(items)
+        self.total_cookies = total_cookies
+        self.optimal = optimal
+        self.nodes = nodes
+ 
+    def __call__(self, cookies, cps, history, time_left, build_info):
+        """
+        Return the next item of the plan
+        """
+        bought = len(history) - 1
+        if bought < len(self.items):
+            return self.items[bought]
+        return None
+ 
+ 
+def plan_optimal(build_info, duration, max_nodes=1000000, time_limit=10.0):
+    """
+    Search the purchase sequences for the given duration by branch
+    and bound and return a PlanStrategy maximising total cookies.
+ 
+    The search replays simulate_clicker exactly: integer waits from
+    time_until and the same float operations.  It starts from the
+    best heuristic strategy, hill-climbed for up to half of
+    time_limit by inserting, replacing, deleting or swapping single
+    purchases.  A branch is then cut when another state dominates
+    it, or when an upper bound on its final total cannot beat the
+    best plan found so far.
+ 
+    A state dominates another if it is reached no later and, once it
+    has waited for the other, has made at least as many cookies and
+    still has at least as many after buying the copies the other
+    owns and it lacks: it can then buy those, and afterwards every
+    later purchase of the other no later, with at least as much cps.
+    The states checked have the same counts, one more item, or one
+    item swapped for another.
+ 
+    The bound lets cps grow exponentially at the best cps/cost ratio
+    among the next copies, skipping items whose next copy costs more
+    than the cookies there can be by the end.
+ 
+    The number of states grows about fivefold per 100 seconds of
+    duration: with the default BuildInfo the search completes within
+    a few seconds up to about 900 seconds.  Longer durations get the
+    improved plan, with optimal set to False.
+ 
+    If max_nodes states are explored or time_limit seconds pass
+    before the search completes, the best plan found so far is
+    returned with optimal set to False.
+    """
+    deadline = timer.time() + time_limit
+    info = build_info.clone()
+    items = sorted(info.build_items())
+    item_cps = [info.get_cps(item) for item in items]
+ 
+    # cost of the k-th copy of each item, built with update_item so
+    # the costs match the simulator bit for bit
+    cost_info = [info.clone() for dummy_item in items]
+    item_costs = [[info.get_cost(item)] for item in items]
+    def get_cost(idx, count):
+        """
+        Return the cost of item idx after count purchases
+        """
+        costs = item_costs[idx]
+        while len(costs) <= count:
+            cost_info[idx].update_item(items[idx])
+            costs.append(cost_info[idx].get_cost(items[idx]))
+        return costs[count]
+ 
+    # a state is (time, cookies, cps, total cookies, item counts)
+    def buy(state, idx):
+        """
+        Return the state after buying item idx as soon as it is
+        affordable, or None if there is not enough time left
+        """
+        time, cookies, cps, total, counts = state
+        cost = get_cost(idx, counts[idx])
+        wait_time = max(0.0, float(math.ceil((cost - cookies) / cps)))
+        if wait_time > duration - time:
+            return None
+        if wait_time > 0:
+            cookies += wait_time * cps
+            total += wait_time * cps
+        return (time + wait_time, cookies - cost, cps + item_cps[idx], total,
+                counts[:idx] + (counts[idx] + 1,) + counts[idx + 1:])
+ 
+    def final_total(state):
+        """
+        Return the total cookies at duration if nothing more is bought
+        """
+        time, dummy_cookies, cps, total, dummy_counts = state
+        return total + (duration - time) * cps
+ 
+    def replay(state, plan):
+        """
+        Buy the items of plan in order from state, stopping at the
+        first one there is no time for.  Return the final total
+        cookies and the number of items bought.
+        """
+        for bought in range(len(plan)):
+            next_state = buy(state, plan[bought])
+            if next_state is None:
+                return final_total(state), bought
+            state = next_state
+        return final_total(state), len(plan)
+ 
+    def improve(plan, stop_time):
+        """
+        Hill-climb from plan: at each position in turn, make the best
+        of inserting, replacing, deleting or swapping one purchase if
+        it raises the final total, until a pass finds nothing or
+        stop_time.  Return the final total and the plan.
+        """
+        root = (0.0, 0.0, 1.0, 0.0, (0,) * len(items))
+        value, bought = replay(root, plan)
+        plan = plan[:bought]
+        improved = True
+        while improved and timer.time() < stop_time:
+            improved = False
+            state = root
+            pos = 0
+            while pos <= len(plan) and timer.time() < stop_time:
+                tail = plan[pos:]
+                moves = [tail[1:], tail[1:2] + tail[:1] + tail[2:]]
+                for idx in range(len(items)):
+                    moves.append([idx] + tail)
+                    moves.append([idx] + tail[1:])
+                better = None
+                for move in moves:
+                    move_value, bought = replay(state, move)
+                    if move_value > value:
+                        value, better = move_value, move[:bought]
+                if better is not None:
+                    plan = plan[:pos] + better
+                    improved = True
+                if pos < len(plan):
+                    state = buy(state, plan[pos])
+                pos += 1
+        return value, plan
+ 
+    # start from the best of the heuristic strategies, improved for
+    # at most half the time
+    best_total = -1.0
+    best_plan = []
+    for strategy in (strategy_best, strategy_cheap, strategy_expensive, strategy_none):
+        state = simulate_clicker(info, duration, strategy)
+        if state.get_total_cookies() > best_total:
+            best_total = state.get_total_cookies()
+            best_plan = [items.index(record[1])
+                         for record in state.get_history_view()[1:]]
+    best_total, best_plan = improve(best_plan, deadline - time_limit / 2.0)
+    best_plan = [items[idx] for idx in best_plan]
+ 
+    def upper_bound(state):
+        """
+        Return an upper bound on the final total cookies from state
+        """
+        time, cookies, cps, total, counts = state
+        time_left = duration - time
+        ratios = sorted([(item_cps[idx] / get_cost(idx, counts[idx]), idx)
+                         for idx in range(len(items))])
+        while ratios:
+            ratio, idx = ratios.pop()
+            exponent = ratio * time_left
+            if exponent > 700:
+                return float('inf')
+            bound = total + (cps + ratio * cookies) * math.expm1(exponent) / ratio
+            # an item whose next copy costs more than all the cookies
+            # there can be by then is never bought, so skip its ratio
+            if get_cost(idx, counts[idx]) <= cookies + bound - total:
+                return bound
+        return total + cps * time_left
+ 
+    # item counts -> cps and frontier of (time, cookies, total) of the
+    # states reached so far that are not dominated by one another
+    seen = {}
+    # item counts less one copy -> (item, cps, frontier) of the counts
+    # seen with that copy
+    cores = {}
+    def beaten(frontier, cps, state, missing_cost):
+        """
+        Return whether a state of frontier, making cps, dominates
+        state while lacking copies that cost missing_cost
+        """
+        time, cookies, dummy_cps, total, dummy_counts = state
+        for old_time, old_cookies, old_total in frontier:
+            if old_time <= time:
+                made = (time - old_time) * cps
+                if (old_total + made >= total and
+                        old_cookies + made - missing_cost >= cookies):
+                    return True
+        return False
+ 
+    def dominated(state):
+        """
+        Return whether a state reached so far dominates this one,
+        recording the state otherwise.  The states checked have the
+        same counts, one more item, or one item swapped for another.
+        """
+        time, cookies, cps, total, counts = state
+        for idx in range(len(items)):
+            if counts[idx]:
+                core = counts[:idx] + (counts[idx] - 1,) + counts[idx + 1:]
+                missing = item_costs[idx][counts[idx] - 1]
+                for other, other_cps, frontier in cores.get(core, ()):
+                    if other == idx:
+                        missing_cost = 0.0
+                    else:
+                        missing_cost = missing
+                    if beaten(frontier, other_cps, state, missing_cost):
+                        return True
+        for dummy_other, other_cps, frontier in cores.get(counts, ()):
+            if beaten(frontier, other_cps, state, 0.0):
+                return True
+ 
+        if counts not in seen:
+            seen[counts] = (cps, [])
+            for idx in range(len(items)):
+                if counts[idx]:
+                    core = counts[:idx] + (counts[idx] - 1,) + counts[idx + 1:]
+                    cores.setdefault(core, []).append((idx, cps, seen[counts][1]))
+        frontier = seen[counts][1]
+        frontier[:] = [(old_time, old_cookies, old_total)
+                       for old_time, old_cookies, old_total in frontier
+                       if not (time <= old_time and
+                               cookies + (old_time - time) * cps >= old_cookies and
+                               total + (old_time - time) * cps >= old_total)]
+        frontier.append((time, cookies, total))
+        return False
+ 
+    nodes = 0
+    complete = True
+    # each entry: state, plan as nested (item, parent) pairs
+    stack = [((0.0, 0.0, 1.0, 0.0, (0,) * len(items)), None)]
+    while stack:
+        if nodes >= max_nodes or (not nodes % 1024 and timer.time() > deadline):
+            complete = False
+            break
+        state, plan = stack.pop()
+        nodes += 1
+ 
+        if final_total(state) > best_total:
+            best_total = final_total(state)
+            best_plan = []
+            link = plan
+            while link is not None:
+                best_plan.append(items[link[0]])
+                link = link[1]
+            best_plan.reverse()
+ 
+        children = []
+        for idx in range(len(items)):
+            child = buy(state, idx)
+            if child is None or dominated(child):
+                continue
+            if upper_bound(child) <= best_total:
+                continue
+            children.append((item_cps[idx] / get_cost(idx, state[4][idx]),
+                             (child, (idx, plan))))
+ 
+        # explore the best cps/cost ratio first
+        children.sort()
+        stack.extend([child for dummy_ratio, child in children])
+ 
+    return PlanStrategy(best_plan, best_total, complete, nodes)
+ 
+ 
+def run_cell(cell):
+    """
+    Run one tournament cell, a tuple (strategy name, strategy,
+    BuildInfo name, BuildInfo, duration), and return its row of
+    results.
+    """
+    strategy_name, strategy, info_name, build_info, duration = cell
+    start = timer.time()
+    state = simulate_clicker(build_info, duration, strategy)
+    return {"strategy": strategy_name,
+            "build_info": info_name,
+            "duration": duration,
+            "total_cookies": state.get_total_cookies(),
+            "cps": state.get_cps(),
+            "purchases": len(state.get_history_view()) - 1,
+            "wall_time": timer.time() - start}
+ 
+ 
+def run_tournament(strategies, build_infos, durations, processes=1):
+    """
+    Run every combination of strategies, BuildInfo variants and
+    durations.  strategies and build_infos are lists of (name, value)
+    pairs.  With processes > 1 the cells are spread over a
+    multiprocessing pool, longest durations first.
+ 
+    Returns the list of run_cell rows in strategy, BuildInfo,
+    duration order.
+    """
+    cells = [(strategy_name, strategy, info_name, build_info, duration)
+             for strategy_name, strategy in strategies
+             for info_name, build_info in build_infos
+             for duration in durations]
+    if processes <= 1:
+        return [run_cell(cell) for cell in cells]
+ 
+    # multiprocessing is not available in CodeSkulptor, so only
+    # import it when a pool is asked for
+    import multiprocessing
+    order = sorted(range(len(cells)), key=lambda idx: -cells[idx][4])
+    pool = multiprocessing.Pool(processes)
+    try:
+        rows = pool.map(run_cell, [cells[idx] for idx in order], 1)
+    finally:
+        pool.close()
+        pool.join()
+    results = [None] * len(cells)
+    for idx, row in zip(order, rows):
+        results[idx] = row
+    return results
+          
+def run_strategy(strategy_name, time, strategy, history_path=None):
     """
-    Run a simulation for the given time with one strategy.
+    Run a simulation for the given time with one strategy.  With
+    history_path, the history is streamed to that file and only a
+    downsampled series of it is kept to plot.
     """
-    state = simulate_clicker(provided.BuildInfo(), time, strategy)
+    if history_path is None:
+        history = HistoryStore()
+    else:
+        history = StreamingHistory(history_path)
+    state = simulate_clicker(provided.BuildInfo(), time, strategy, history=history)
     print strategy_name, ":", state
  
     # Plot total cookies over time
@@ -217,9 +1387,9 @@ def run_strategy(strategy_name, time, strategy):
     # Uncomment out the lines below to see a plot of total cookies vs. time
     # Be sure to allow popups, if you do want to see it
  
-    # history = state.get_history()
-    # history = [(item[0], item[3]) for item in history]
-    # simpleplot.plot_lines(strategy_name, 1000, 400, 'Time', 'Total Cookies', [history], True)
+    # simpleplot.plot_lines(strategy_name, 1000, 400, 'Time', 'Total Cookies', [history.series()], True)
+    if history_path is not None:
+        history.close()
  
 def run():
     """
@@ -232,4 +1402,5 @@ def run():
     run_strategy("Expensive", SIM_TIME, strategy_expensive)
     run_strategy("Best", SIM_TIME, strategy_best)  
  
-run()
+if __name__ == "__main__":
+    run()
@@ -15,6 +15,15 @@ INITIAL_SALARY = 100
 SALARY_INCREMENT = 100
 INITIAL_BRIBE_COST = 1000
 
+# runs of bribes this long are extended in closed form by bribe_runs
+LONG_RUN = 16
+
+# bribe_cycles looks for spacing patterns of up to MAX_PERIOD bribes
+# repeating over windows of CYCLE_WINDOW to MAX_CYCLE_WINDOW bribes
+MAX_PERIOD = 8
+CYCLE_WINDOW = 32
+MAX_CYCLE_WINDOW = 1024
+
 
 def greedy_boss(days_in_simulation, bribe_cost_increment, plot_type = STANDARD):
     """
@@ -62,6 +71,484 @@ def greedy_boss(days_in_simulation, bribe_cost_increment, plot_type = STANDARD):
     return days_vs_earnings
 
 
+def greedy_boss_batch(days_in_simulation, bribe_cost_increments,
+                      initial_salaries = None, initial_bribe_costs = None):
+    """
+    Simulation of greedy boss for many scenarios at once
+
+    Scenario idx uses bribe_cost_increments[idx] and, if given,
+    initial_salaries[idx] and initial_bribe_costs[idx] instead of
+    INITIAL_SALARY and INITIAL_BRIBE_COST.  Identical scenarios are
+    only simulated once, each with a tight loop in exact integer
+    arithmetic that skips the float division, math.ceil and plot
+    type test greedy_boss does for every bribe.  The output has one
+    point per bribe, so the work cannot drop below that.
+
+    Returns a ragged list holding the (day, total salary earned) list
+    of every scenario, as greedy_boss would with STANDARD plots
+    """
+    num_scenarios = len(bribe_cost_increments)
+    if initial_salaries is None:
+        initial_salaries = [INITIAL_SALARY] * num_scenarios
+    if initial_bribe_costs is None:
+        initial_bribe_costs = [INITIAL_BRIBE_COST] * num_scenarios
+    
+    # one simulation per distinct scenario
+    results = {}
+    batch = []
+    for idx in range(num_scenarios):
+        key = (bribe_cost_increments[idx], initial_salaries[idx], initial_bribe_costs[idx])
+        if key in results:
+            batch.append(list(results[key]))
+        else:
+            bribe_cost_increment, current_salary, current_bribe_cost = key
+            current_day = 0
+            current_savings = 0
+            total_salary_earned = 0
+            days_vs_earnings = [(0, 0)]
+            append = days_vs_earnings.append
+            while current_day < days_in_simulation:
+                if current_savings >= current_bribe_cost:
+                    days_to_next_bribe = 0
+                else:
+                    days_to_next_bribe = -((current_savings - current_bribe_cost) // current_salary)
+                current_day += days_to_next_bribe
+                earned = days_to_next_bribe * current_salary
+                current_savings += earned - current_bribe_cost
+                total_salary_earned += earned
+                current_bribe_cost += bribe_cost_increment
+                current_salary += SALARY_INCREMENT
+                append((current_day, total_salary_earned))
+            results[key] = days_vs_earnings
+            batch.append(days_vs_earnings)
+    
+    return batch
+
+
+def days_to_bribe(savings, bribe_cost, salary):
+    """
+    Days until the next bribe can be paid, in exact integer
+    arithmetic (0 if it can be paid right away)
+    """
+    if savings >= bribe_cost:
+        return 0
+    return -((savings - bribe_cost) // salary)
+
+
+def state_after_bribes(state, days_per_bribe, num_bribes,
+                       bribe_cost_increment, salary_increment):
+    """
+    State after num_bribes bribes paid days_per_bribe days apart,
+    computed in closed form.  A state is the tuple
+    (day, savings, total salary earned, bribe cost, salary) just
+    before a bribe.
+    """
+    day, savings, earned, bribe_cost, salary = state
+    pairs = num_bribes * (num_bribes - 1) // 2
+    earned_gain = days_per_bribe * (num_bribes * salary + salary_increment * pairs)
+    return (day + num_bribes * days_per_bribe,
+            savings + earned_gain - (num_bribes * bribe_cost + bribe_cost_increment * pairs),
+            earned + earned_gain,
+            bribe_cost + num_bribes * bribe_cost_increment,
+            salary + num_bribes * salary_increment)
+
+
+def min_over_range(func, last):
+    """
+    Minimum of func(idx) for idx in 0..last, where func is a
+    quadratic polynomial in idx
+    """
+    value_0, value_1, value_2 = func(0), func(1), func(2)
+    candidates = [0, last]
+    second_diff = value_2 - 2 * value_1 + value_0
+    if second_diff > 0:
+        # convex: the minimum is next to the vertex
+        vertex = (second_diff - 2 * (value_1 - value_0)) // (2 * second_diff)
+        candidates += [min(max(vertex, 0), last), min(max(vertex + 1, 0), last)]
+    return min([func(idx) for idx in candidates])
+
+
+def longest_run(state, days_per_bribe, known_length, days_in_simulation,
+                bribe_cost_increment, salary_increment):
+    """
+    Number of bribes from state paid days_per_bribe days apart
+    before the spacing changes or the simulation ends, given that
+    the first known_length of them are
+    """
+    day, dummy_savings, dummy_earned, dummy_bribe_cost, salary = state
+    
+    def gap(idx):
+        """
+        Bribe cost minus savings before bribe idx of the run
+        """
+        after = state_after_bribes(state, days_per_bribe, idx,
+                                   bribe_cost_increment, salary_increment)
+        return after[3] - after[1]
+    
+    def salary_at(idx):
+        """
+        Salary before bribe idx of the run
+        """
+        return salary + idx * salary_increment
+    
+    def is_run(num_bribes):
+        """
+        Whether the next num_bribes bribes are all paid
+        days_per_bribe days apart, within the simulation
+        """
+        last = num_bribes - 1
+        if day + last * days_per_bribe >= days_in_simulation:
+            return False
+        if days_per_bribe == 0:
+            return min_over_range(lambda idx: -gap(idx), last) >= 0
+        return (min_over_range(lambda idx: gap(idx) - (days_per_bribe - 1) * salary_at(idx), last) > 0
+                and min_over_range(lambda idx: days_per_bribe * salary_at(idx) - gap(idx), last) >= 0)
+    
+    low, high = known_length, 2 * known_length
+    while is_run(high):
+        low, high = high, 2 * high
+    while high - low > 1:
+        middle = (low + high) // 2
+        if is_run(middle):
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+def bribe_runs(days_in_simulation, bribe_cost_increment,
+               initial_salary = INITIAL_SALARY,
+               salary_increment = SALARY_INCREMENT,
+               initial_bribe_cost = INITIAL_BRIBE_COST):
+    """
+    Generate the bribes of greedy_boss grouped into runs of bribes
+    paid the same number of days apart, as tuples
+    (state before the run, days per bribe, number of bribes).
+
+    Within a run, the gap between bribe cost and savings is a
+    quadratic polynomial in the bribe number, so whether a run of a
+    given length is valid is checked in constant time and the
+    longest run is found by galloping and bisection.  Runs of bribes
+    every day (0 or 1 days apart), or any fixed number of days apart,
+    are then skipped in closed form whatever their length.  Runs are
+    long once bribes settle into a fixed spacing, e.g. when the bribe
+    increment is a multiple of the salary increment.
+
+    Bribes are first stepped one at a time with plain integer
+    updates, and the search only starts once a run reaches
+    LONG_RUN bribes, so when the spacing keeps changing the work
+    stays close to that of greedy_boss.
+    """
+    state = (0, 0, 0, initial_bribe_cost, initial_salary)
+    days_per_bribe = days_to_bribe(0, initial_bribe_cost, initial_salary)
+    while state[0] < days_in_simulation:
+        run_state = state
+        
+        # step while the spacing holds, up to LONG_RUN bribes
+        num_bribes = 0
+        while True:
+            day, savings, earned, bribe_cost, salary = state
+            earned_gain = days_per_bribe * salary
+            state = (day + days_per_bribe, savings + earned_gain - bribe_cost,
+                     earned + earned_gain, bribe_cost + bribe_cost_increment,
+                     salary + salary_increment)
+            num_bribes += 1
+            next_days = days_to_bribe(state[1], state[3], state[4])
+            if (state[0] >= days_in_simulation or next_days != days_per_bribe
+                    or num_bribes == LONG_RUN):
+                break
+        
+        if num_bribes == LONG_RUN and state[0] < days_in_simulation \
+                and next_days == days_per_bribe:
+            num_bribes = longest_run(run_state, days_per_bribe, LONG_RUN + 1,
+                                     days_in_simulation, bribe_cost_increment,
+                                     salary_increment)
+            state = state_after_bribes(run_state, days_per_bribe, num_bribes,
+                                       bribe_cost_increment, salary_increment)
+            next_days = days_to_bribe(state[1], state[3], state[4])
+        
+        yield run_state, days_per_bribe, num_bribes
+        days_per_bribe = next_days
+
+
+def greedy_boss_stream(days_in_simulation, bribe_cost_increment, stride = 1):
+    """
+    Lazy version of greedy_boss with exact integer arithmetic
+
+    Yields (0, 0) and then (day, total salary earned) after every
+    stride-th bribe, plus the final bribe.  With stride 1 this gives
+    the same points as greedy_boss with STANDARD plots.  The work
+    done grows with the number of points yielded and of bribe_runs,
+    not with the number of days, so huge horizons are feasible with
+    a large stride.
+    """
+    yield (0, 0)
+    num_bribes = 0
+    last_point = None
+    final_point = None
+    for state, days_per_bribe, run_length in bribe_runs(days_in_simulation, bribe_cost_increment):
+        if run_length <= LONG_RUN:
+            # short runs were stepped by bribe_runs, step them here too
+            day, dummy_savings, earned, dummy_bribe_cost, salary = state
+            for dummy_bribe in range(run_length):
+                day += days_per_bribe
+                earned += days_per_bribe * salary
+                salary += SALARY_INCREMENT
+                num_bribes += 1
+                if not num_bribes % stride:
+                    last_point = num_bribes
+                    yield (day, earned)
+            final_point = (day, earned)
+            continue
+        
+        # next bribe number in the run that falls on the stride
+        first = num_bribes + stride - num_bribes % stride
+        for bribe in range(first, num_bribes + run_length + 1, stride):
+            after = state_after_bribes(state, days_per_bribe, bribe - num_bribes,
+                                       bribe_cost_increment, SALARY_INCREMENT)
+            last_point = bribe
+            yield (after[0], after[2])
+        num_bribes += run_length
+        after = state_after_bribes(state, days_per_bribe, run_length,
+                                   bribe_cost_increment, SALARY_INCREMENT)
+        final_point = (after[0], after[2])
+    
+    if num_bribes and last_point != num_bribes:
+        yield final_point
+
+
+def state_after_cycles(state, spacings, num_bribes,
+                       bribe_cost_increment, salary_increment):
+    """
+    State after num_bribes bribes whose spacings repeat the pattern
+    spacings, computed in closed form.  With a single spacing this
+    is state_after_bribes.
+    """
+    day, savings, earned, bribe_cost, salary = state
+    period = len(spacings)
+    periods, phase = divmod(num_bribes, period)
+    
+    # days and salary earned over the first phase bribes of a
+    # period and over a whole period, at the salary of the first one
+    phase_days = sum(spacings[:phase])
+    period_days = sum(spacings)
+    earned_by_bribe = [spacings[idx] * (salary + idx * salary_increment)
+                       for idx in range(period)]
+    phase_earned = sum(earned_by_bribe[:phase])
+    period_earned = sum(earned_by_bribe)
+    
+    # every later period earns period * salary_increment more per day
+    raise_per_day = period * salary_increment
+    earned_gain = (periods * period_earned
+                   + raise_per_day * period_days * (periods * (periods - 1) // 2)
+                   + phase_earned + raise_per_day * periods * phase_days)
+    pairs = num_bribes * (num_bribes - 1) // 2
+    return (day + periods * period_days + phase_days,
+            savings + earned_gain - (num_bribes * bribe_cost + bribe_cost_increment * pairs),
+            earned + earned_gain,
+            bribe_cost + num_bribes * bribe_cost_increment,
+            salary + num_bribes * salary_increment)
+
+
+def longest_cycle_run(state, spacings, known_periods, days_in_simulation,
+                      bribe_cost_increment, salary_increment):
+    """
+    Number of whole periods of the spacing pattern paid from state
+    before the pattern breaks or the simulation ends, given that
+    the first known_periods are
+    """
+    period = len(spacings)
+    
+    def margins(phase, periods):
+        """
+        For bribe phase of the period numbered periods, how far the
+        gap between bribe cost and savings is inside the range that
+        gives the pattern's spacing: (above the lower end, below the
+        upper end)
+        """
+        after = state_after_cycles(state, spacings, periods * period + phase,
+                                   bribe_cost_increment, salary_increment)
+        gap = after[3] - after[1]
+        days = spacings[phase]
+        if days == 0:
+            return 1, -gap
+        return gap - (days - 1) * after[4], days * after[4] - gap
+    
+    def is_cycle_run(num_periods):
+        """
+        Whether the next num_periods periods all follow the pattern,
+        within the simulation
+        """
+        last = num_periods - 1
+        if state_after_cycles(state, spacings, num_periods * period - 1,
+                              bribe_cost_increment, salary_increment)[0] >= days_in_simulation:
+            return False
+        for phase in range(period):
+            if (min_over_range(lambda idx: margins(phase, idx)[0], last) <= 0
+                    or min_over_range(lambda idx: margins(phase, idx)[1], last) < 0):
+                return False
+        return True
+    
+    low, high = known_periods, 2 * known_periods
+    while is_cycle_run(high):
+        low, high = high, 2 * high
+    while high - low > 1:
+        middle = (low + high) // 2
+        if is_cycle_run(middle):
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+def bribe_cycles(days_in_simulation, bribe_cost_increment,
+                 initial_salary = INITIAL_SALARY,
+                 salary_increment = SALARY_INCREMENT,
+                 initial_bribe_cost = INITIAL_BRIBE_COST):
+    """
+    Generate the bribes of greedy_boss grouped into runs in which
+    the spacing between bribes repeats a pattern, as tuples
+    (state before the run, tuple of spacings, number of periods).
+
+    Like bribe_runs, but bribes are also grouped when the spacing
+    alternates, e.g. 1, 2, 1, 2 with a bribe cost increment of 1.5
+    times the salary increment.  Bribes are stepped one at a time
+    and every half window the last window of them is checked for a
+    pattern of up to MAX_PERIOD bribes; the run is then extended in
+    closed form by longest_cycle_run, the gap between bribe cost and
+    savings being quadratic in the period number for each bribe of
+    the pattern.  Bribes that are not part of a pattern are yielded
+    on their own.
+
+    Extending a run costs as much as stepping hundreds of bribes, so
+    the window doubles, up to MAX_CYCLE_WINDOW, whenever a run turns
+    out short.  When the spacing drifts without settling into a
+    pattern (e.g. a bribe cost increment of 3.33 times the salary
+    increment) the work stays close to that of greedy_boss.
+    """
+    state = (0, 0, 0, initial_bribe_cost, initial_salary)
+    days_per_bribe = days_to_bribe(0, initial_bribe_cost, initial_salary)
+    window_size = CYCLE_WINDOW
+    window_states = []
+    window_days = []
+    while state[0] < days_in_simulation:
+        day, savings, earned, bribe_cost, salary = state
+        window_states.append(state)
+        window_days.append(days_per_bribe)
+        earned_gain = days_per_bribe * salary
+        state = (day + days_per_bribe, savings + earned_gain - bribe_cost,
+                 earned + earned_gain, bribe_cost + bribe_cost_increment,
+                 salary + salary_increment)
+        days_per_bribe = days_to_bribe(state[1], state[3], state[4])
+        if len(window_days) < window_size:
+            continue
+        
+        # smallest period of the spacings in the window, if any
+        spacings = None
+        for period in range(1, MAX_PERIOD + 1):
+            if window_days[period:] == window_days[:-period]:
+                spacings = tuple(window_days[:period])
+                break
+        if spacings is None or state[0] >= days_in_simulation:
+            half = window_size // 2
+            for idx in range(half):
+                yield window_states[idx], (window_days[idx],), 1
+            del window_states[:half]
+            del window_days[:half]
+            continue
+        
+        num_periods = longest_cycle_run(window_states[0], spacings,
+                                        window_size // len(spacings),
+                                        days_in_simulation, bribe_cost_increment,
+                                        salary_increment)
+        yield window_states[0], spacings, num_periods
+        if num_periods * len(spacings) < 4 * window_size:
+            window_size = min(2 * window_size, MAX_CYCLE_WINDOW)
+        else:
+            window_size = max(window_size // 2, CYCLE_WINDOW)
+        state = state_after_cycles(window_states[0], spacings, num_periods * len(spacings),
+                                   bribe_cost_increment, salary_increment)
+        days_per_bribe = days_to_bribe(state[1], state[3], state[4])
+        window_states = []
+        window_days = []
+    
+    for idx in range(len(window_states)):
+        yield window_states[idx], (window_days[idx],), 1
+
+
+def optimal_bribes(days_in_simulation, bribe_cost_increment,
+                   initial_salary = INITIAL_SALARY,
+                   salary_increment = SALARY_INCREMENT,
+                   initial_bribe_cost = INITIAL_BRIBE_COST):
+    """
+    Find the number of bribes that leaves the most money (savings)
+    at the end of the simulation
+
+    Once the number of bribes is fixed, paying each as soon as it
+    is affordable, as greedy_boss does, is best: every raise starts
+    as early as possible.  Stopping after n bribes instead of n + 1
+    changes the final savings by
+        salary_increment * (days left after bribe n + 1) - its cost,
+    which only decreases with n, so the best n is the number of
+    leading bribes that pay for themselves.  The search walks the
+    bribe_cycles and bisects on the bribe number inside the run
+    where the difference turns negative, so it takes time
+    proportional to the number of runs before the stopping point.
+
+    Returns a tuple (final savings, number of bribes, day of the
+    last bribe)
+    """
+    num_bribes = 0
+    stop_run = ((0, 0, 0, initial_bribe_cost, initial_salary), (0,), 0)
+    for state, spacings, num_periods in bribe_cycles(days_in_simulation, bribe_cost_increment,
+                                                      initial_salary, salary_increment,
+                                                      initial_bribe_cost):
+        if num_periods == 1 and len(spacings) == 1:
+            # single bribes are common, check them without the closed form
+            day, dummy_savings, dummy_earned, bribe_cost, dummy_salary = state
+            if salary_increment * (days_in_simulation - day - spacings[0]) <= bribe_cost:
+                stop_run = (state, spacings, 0)
+                break
+            num_bribes += 1
+            stop_run = (state, spacings, 1)
+            continue
+        
+        run_length = num_periods * len(spacings)
+        
+        def gain(idx):
+            """
+            Change in final savings from paying bribe idx of the run
+            """
+            after = state_after_cycles(state, spacings, idx + 1,
+                                       bribe_cost_increment, salary_increment)
+            return (salary_increment * (days_in_simulation - after[0])
+                    - (after[3] - bribe_cost_increment))
+        
+        # bribes 0..worth_paying - 1 of the run pay for themselves
+        if gain(run_length - 1) > 0:
+            worth_paying = run_length
+        else:
+            low, high = -1, run_length - 1
+            while high - low > 1:
+                middle = (low + high) // 2
+                if gain(middle) > 0:
+                    low = middle
+                else:
+                    high = middle
+            worth_paying = high
+        
+        num_bribes += worth_paying
+        stop_run = (state, spacings, worth_paying)
+        if worth_paying < run_length:
+            break
+    
+    state, spacings, worth_paying = stop_run
+    day, savings, dummy_earned, dummy_bribe_cost, salary = \
+        state_after_cycles(state, spacings, worth_paying,
+                           bribe_cost_increment, salary_increment)
+    return (savings + (days_in_simulation - day) * salary, num_bribes, day)
+
+
 def run_simulations():
     """
     Run simulations for several possible bribe increments
@@ -2,7 +2,9 @@
 Interactive simulation for Monte Hall problem
 """
 
+import math
 import random
+import time
 import simplegui
 
 # global constants
@@ -13,12 +15,181 @@ CENTER_VERT = 0.3
 CENTER_HORIZ = 0.8
 
 MIN_DOORS = 3
-MAX_DOORS = 10
+MAX_DOORS = 100
+
+# number of frames between updates of the frame time label
+FRAME_REPORT = 60
 
 SELECT = 0
 CHOOSE = 1
 SHOW = 2
 
+# policies for the final choice
+STAY = "stay"
+SWITCH = "switch"
+
+
+def reveal_door(prize_door, selected_door, num_doors, rng=random):
+    """
+    Return the door left closed next to the selected one: the prize
+    door, or a random other door if the prize door was selected
+    """
+    if selected_door != prize_door:
+        return prize_door
+    door = rng.randrange(num_doors - 1)
+    if door >= selected_door:
+        door += 1
+    return door
+
+
+class MontyHallGame:
+    """
+    Rules of the Monty Hall game, without any user interface
+    """
+    
+    def __init__(self, num_doors=MIN_DOORS, rng=random):
+        """
+        Start a game with the given number of doors
+        """
+        self._rng = rng
+        self.clear(num_doors)
+    
+    def clear(self, num_doors=MIN_DOORS):
+        """
+        Reset the score and start a new round
+        """
+        self._num_doors = num_doors
+        self._wins = 0
+        self._loses = 0
+        self._state = SELECT
+        self._selected_door = None
+        self._show_door = None
+        self._prize_door = self._rng.randrange(num_doors)
+    
+    def set_num_doors(self, num_doors):
+        """
+        Change the number of doors
+        """
+        self._num_doors = num_doors
+    
+    def get_num_doors(self):
+        """
+        Return the number of doors
+        """
+        return self._num_doors
+    
+    def get_state(self):
+        """
+        Return SELECT, CHOOSE or SHOW
+        """
+        return self._state
+    
+    def get_wins(self):
+        """
+        Return the number of rounds won
+        """
+        return self._wins
+    
+    def get_loses(self):
+        """
+        Return the number of rounds lost
+        """
+        return self._loses
+    
+    def get_selected_door(self):
+        """
+        Return the door selected first
+        """
+        return self._selected_door
+    
+    def get_show_door(self):
+        """
+        Return the other door left closed
+        """
+        return self._show_door
+    
+    def get_prize_door(self):
+        """
+        Return the door with the prize
+        """
+        return self._prize_door
+    
+    def is_valid_door(self, door_num):
+        """
+        Check whether a door can be picked in the current state
+        """
+        if self._state == CHOOSE:
+            return door_num == self._selected_door or door_num == self._show_door
+        return True
+    
+    def process_door(self, door_num):
+        """
+        Process a valid door number based on state
+        """
+        if self._state == SELECT:
+            self._state = CHOOSE
+            self._selected_door = door_num
+            self._show_door = reveal_door(self._prize_door, door_num,
+                                          self._num_doors, self._rng)
+        elif self._state == CHOOSE:
+            if door_num == self._prize_door:
+                self._wins += 1
+            else:
+                self._loses += 1
+            self._state = SHOW
+        elif self._state == SHOW:
+            self._prize_door = self._rng.randrange(self._num_doors)
+            self._state = SELECT
+
+
+def simulate_monty_hall(trials, num_doors=MIN_DOORS, policy=SWITCH, rng=None):
+    """
+    Play trials rounds without a GUI.  policy is STAY, SWITCH or the
+    probability of switching.  Rounds follow the same rules as
+    MontyHallGame, through reveal_door.
+
+    Returns a dictionary with the win count, the win rate, its 95%
+    Wilson confidence interval and the trials per second
+    """
+    if trials < 1:
+        raise ValueError("trials must be at least 1")
+    if rng is None:
+        rng = random.Random()
+    if policy == STAY:
+        switch_prob = 0.0
+    elif policy == SWITCH:
+        switch_prob = 1.0
+    elif isinstance(policy, (int, float)) and 0 <= policy <= 1:
+        switch_prob = float(policy)
+    else:
+        raise ValueError("policy must be STAY, SWITCH or a probability in [0, 1]")
+    
+    randrange = rng.randrange
+    uniform = rng.random
+    start = time.time()
+    wins = 0
+    for dummy_trial in xrange(trials):
+        prize_door = randrange(num_doors)
+        selected_door = randrange(num_doors)
+        if switch_prob and (switch_prob == 1.0 or uniform() < switch_prob):
+            selected_door = reveal_door(prize_door, selected_door, num_doors, rng)
+        if selected_door == prize_door:
+            wins += 1
+    elapsed = max(time.time() - start, 1e-9)
+    
+    # Wilson score interval at 95%
+    z_score = 1.96
+    win_rate = wins / float(trials)
+    center = win_rate + z_score * z_score / (2.0 * trials)
+    spread = z_score * math.sqrt(win_rate * (1 - win_rate) / trials +
+                                 z_score * z_score / (4.0 * trials ** 2))
+    scale = 1 + z_score * z_score / trials
+    return {"trials": trials,
+            "wins": wins,
+            "win_rate": win_rate,
+            "confidence_interval": ((center - spread) / scale, (center + spread) / scale),
+            "trials_per_sec": trials / elapsed}
+
 
 class MontyHallGUI:
     """
@@ -38,6 +209,12 @@ class MontyHallGUI:
         self._frame.add_label("")
         self._win_label = self._frame.add_label("Wins = 0")
         self._lose_label = self._frame.add_label("Loses = 0")
+        self._frame_label = self._frame.add_label("Frame time = 0.0 ms")
+        self._game = MontyHallGame()
+        self._render_list = None
+        self._frames = 0
+        self._draw_calls = 0
+        self._frame_time = 0.0
         self.clear()
         self._frame.set_draw_handler(self.draw)
         self._frame.start()
@@ -46,96 +223,101 @@ class MontyHallGUI:
         """
         Clear the simulatin
         """
-        self._game_state = SELECT
-        self._wins = 0
-        self._loses = 0
-        self._num_doors = MIN_DOORS
-        self._win_label.set_text("Wins = " + str(self._wins))
-        self._lose_label.set_text("Loses = " + str(self._loses))
-        self._prize_door = random.randrange(self._num_doors)
+        self._game.clear(MIN_DOORS)
+        self._render_list = None
+        self.update_labels()
         
+    def update_labels(self):
+        """
+        Show the score of the game
+        """
+        self._win_label.set_text("Wins = " + str(self._game.get_wins()))
+        self._lose_label.set_text("Loses = " + str(self._game.get_loses()))
         
     def click(self, pos):
         """
         Convert a canvas click to a door number, reject invalid click when staying or switching
         """
-        door_width = CANVAS_WIDTH / self._num_doors
-        door_num = min(pos[0] / door_width, self._num_doors)
-        if self._game_state == SELECT:
+        door_width = CANVAS_WIDTH / float(self._game.get_num_doors())
+        door_num = min(int(pos[0] / door_width), self._game.get_num_doors() - 1)
+        if self._game.is_valid_door(door_num):
             self.process_door(door_num)
-        elif self._game_state == CHOOSE:
-            if door_num == self._selected_door or door_num == self._show_door:
-                self.process_door(door_num)
-        elif self._game_state == SHOW:
-           self.process_door(door_num)
                 
                 
     def process_door(self, door_num):
         """
         Process a valid door number based on state
         """
-        if self._game_state == SELECT:
-            self._game_state = CHOOSE
-            self._selected_door = door_num
-            if door_num == self._prize_door:
-                show_doors = range(self._num_doors)
-                show_doors.remove(door_num)
-                self._show_door = random.choice(show_doors)
-            else:
-                self._show_door = self._prize_door              
-        elif self._game_state == CHOOSE:
-            if door_num == self._prize_door:
-                self._wins += 1
-                self._win_label.set_text("Wins = " + str(self._wins))
-            else:
-                self._loses += 1   
-                self._lose_label.set_text("Loses = " + str(self._loses))
-            self._game_state = SHOW
-        elif self._game_state == SHOW:
-            self._prize_door = random.randrange(self._num_doors)
-            self._game_state = SELECT
+        self._game.process_door(door_num)
+        self._render_list = None
+        self.update_labels()
     
     def add_door(self):
         """
         Add a door to the simulation
         """
-        self._num_doors = min(self._num_doors + 1, MAX_DOORS)
+        self._game.set_num_doors(min(self._game.get_num_doors() + 1, MAX_DOORS))
+        self._render_list = None
     
         
-    def draw_door(self, canvas, door_pos, color):
+    def door_color(self, door_num):
         """
-        Draw a single door with positin and color
+        Return the fill color of a door in the current state
         """
-        door_width = CANVAS_WIDTH / self._num_doors
-        canvas.draw_polygon([door_pos,
-                             [door_pos[0] + door_width, door_pos[1]],
-                             [door_pos[0] + door_width, door_pos[1] + CANVAS_HEIGHT],
-                             [door_pos[0], door_pos[1] + CANVAS_HEIGHT]],
-                             4, "Black", color)
-        
+        state = self._game.get_state()
+        if state == SELECT:
+            return "White"
+        elif state == CHOOSE:
+            if door_num == self._game.get_selected_door() or door_num == self._game.get_show_door():
+                return "LightGreen"
+        elif state == SHOW:
+            if door_num == self._game.get_prize_door():
+                return "Gold"
+        return "LightGray"
+    
+    def build_render_list(self):
+        """
+        Compute the polygon, line width and color of every door.
+        Only done after the state changed, not on every frame.
+        """
+        num_doors = self._game.get_num_doors()
+        door_width = CANVAS_WIDTH / float(num_doors)
+        line_width = max(1, min(4, int(door_width / 4)))
+        self._render_list = []
+        for door_num in range(num_doors):
+            left = door_width * door_num
+            polygon = [[left, 0], [left + door_width, 0],
+                       [left + door_width, CANVAS_HEIGHT], [left, CANVAS_HEIGHT]]
+            self._render_list.append((polygon, line_width, self.door_color(door_num)))
+    
+    def get_frame_stats(self):
+        """
+        Return the number of frames and draw calls so far and the
+        average frame time in milliseconds
+        """
+        average = 0.0
+        if self._frames:
+            average = 1000.0 * self._frame_time / self._frames
+        return {"frames": self._frames,
+                "draw_calls": self._draw_calls,
+                "frame_time_ms": average}
     
     def draw(self, canvas):
         """
         Draw the doors
         """
-        door_width = CANVAS_WIDTH / self._num_doors
-        for door_num in range(self._num_doors):
-            door_pos = [door_width * door_num, 0]
-            if self._game_state == SELECT:
-                self.draw_door(canvas, door_pos, "White")
-            elif self._game_state == CHOOSE:
-                if  door_num == self._selected_door:
-                    self.draw_door(canvas, door_pos, "LightGreen")
-                elif  door_num == self._show_door:
-                    self.draw_door(canvas, door_pos, "LightGreen")
-                else:
-                    self.draw_door(canvas, door_pos, "LightGray")
-            elif self._game_state == SHOW:
-                if  door_num == self._prize_door:
-                    self.draw_door(canvas, door_pos, "Gold")
-                else:
-                    self.draw_door(canvas, door_pos, "LightGray")
+        start = time.time()
+        if self._render_list is None:
+            self.build_render_list()
+        for polygon, line_width, color in self._render_list:
+            canvas.draw_polygon(polygon, line_width, "Black", color)
+        self._draw_calls += len(self._render_list)
+        self._frames += 1
+        self._frame_time += time.time() - start
+        if not self._frames % FRAME_REPORT:
+            self._frame_label.set_text("Frame time = %.1f ms" % self.get_frame_stats()["frame_time_ms"])
 
                
 
-MontyHallGUI()       
+if __name__ == "__main__":
+    MontyHallGUI()
@@ -6,6 +6,9 @@ Goal: Move as many seeds from given houses into the store
 In GUI, you make ask computer AI to make move or click to attempt a legal move
 """
 
+import heapq
+import time
+
 
 class SolitaireMancala:
     """
@@ -17,6 +20,7 @@ class SolitaireMancala:
         Create Mancala game with empty store and no houses
         """
         self._board = [0]
+        self._legal = []
     
     def set_board(self, configuration):
         """
@@ -25,6 +29,8 @@ class SolitaireMancala:
         houses are number in ascending order from right to left
         """
         self._board = list(configuration)
+        self._legal = [idx for idx in range(1, len(self._board))
+                       if self._board[idx] == idx]
     
     def __str__(self):
         """
@@ -63,9 +69,12 @@ class SolitaireMancala:
         Last seed must be played in the store (house zero)
         """
         if self.is_legal_move(house_num):
+            board = self._board
             for idx in range(0, house_num):
-                self._board[idx] += 1
-            self._board[house_num] = 0
+                board[idx] += 1
+                if board[idx] == idx and idx:
+                    heapq.heappush(self._legal, idx)
+            board[house_num] = 0
 
     def choose_move(self):
         """
@@ -74,9 +83,11 @@ class SolitaireMancala:
         Note that using a longer legal move would make smaller illegal
         If no legal move, return house zero
         """
-        for idx in range(1, len(self._board)):
-            if self._board[idx] == idx:
-                return self._board[idx]
+        legal = self._legal
+        while legal and self._board[legal[0]] != legal[0]:
+            heapq.heappop(legal)
+        if legal:
+            return legal[0]
         return 0
     
     def plan_moves(self):
@@ -91,11 +102,230 @@ class SolitaireMancala:
         
         moves_list = []
         
-        while board_copy.choose_move() != 0:
+        chosen_move = board_copy.choose_move()
+        while chosen_move != 0:
+            if not board_copy.is_legal_move(chosen_move):
+                break
+            moves_list.append(chosen_move)
+            board_copy.apply_move(chosen_move)
             chosen_move = board_copy.choose_move()
-            if board_copy.is_legal_move(chosen_move):
-                moves_list.append(chosen_move)
-                board_copy.apply_move(chosen_move)
         
         return moves_list
 
+
+    def is_winnable(self):
+        """
+        Check whether the current board can be cleared, without playing it
+        """
+        return is_winnable(self._board)
+    
+    def solve(self, max_nodes=1000000, time_limit=10.0):
+        """
+        Search all move sequences from the current board, see solve_mancala
+        """
+        return solve_mancala(self._board, None, max_nodes, time_limit)
+
+
+def is_winnable(configuration):
+    """
+    Check whether a board can be won, house zero being the store.
+    House i is emptied t_i times and receives one seed each time a
+    higher house is emptied, so from the top house down
+    b_i + (t_(i+1) + t_(i+2) + ...) must be a multiple of i.
+    A house holding more seeds than its number can never be emptied.
+    """
+    later_moves = 0
+    for house_num in range(len(configuration) - 1, 0, -1):
+        seeds = configuration[house_num]
+        if seeds > house_num:
+            return False
+        total = seeds + later_moves
+        if total % house_num:
+            return False
+        later_moves += total // house_num
+    return True
+
+
+class WinningBoardGenerator:
+    """
+    Build the unique winnable board for a number of seeds by playing
+    moves backwards from the empty board: put i seeds in the lowest
+    empty house i and take one seed back from each house below it.
+    Boards are built incrementally from the last one computed.
+    """
+    
+    def __init__(self):
+        """
+        Start from the empty board
+        """
+        self._houses = [0]
+        self._num_seeds = 0
+        self._cache = {0: (0,)}
+    
+    def _unplay_move(self):
+        """
+        Add one seed to the frontier board with a reverse move
+        """
+        houses = self._houses
+        house_num = 1
+        while house_num < len(houses) and houses[house_num]:
+            houses[house_num - 1] -= 1
+            house_num += 1
+        if house_num == len(houses):
+            houses.append(0)
+        houses[house_num - 1] -= 1
+        houses[house_num] = house_num
+        houses[0] = 0
+        self._num_seeds += 1
+    
+    def get_board(self, num_seeds):
+        """
+        Return the winnable configuration (store first) with num_seeds
+        seeds in the houses, as a list
+        """
+        if num_seeds not in self._cache:
+            if num_seeds < self._num_seeds:
+                self._houses = [0]
+                self._num_seeds = 0
+            while self._num_seeds < num_seeds:
+                self._unplay_move()
+            self._cache[num_seeds] = tuple(self._houses)
+        return list(self._cache[num_seeds])
+    
+    def iter_boards(self, max_seeds):
+        """
+        Generate the winnable boards for 0 to max_seeds seeds
+        """
+        self._houses = [0]
+        self._num_seeds = 0
+        yield [0]
+        while self._num_seeds < max_seeds:
+            self._unplay_move()
+            yield list(self._houses)
+
+
+_GENERATOR = WinningBoardGenerator()
+
+
+def winning_board(num_seeds):
+    """
+    Return the winnable configuration with num_seeds seeds in its houses
+    """
+    return _GENERATOR.get_board(num_seeds)
+
+
+def sow_seeds(board, house_num, num_stores):
+    """
+    Standard sowing: one seed into each house towards the store,
+    legal only if the last seed lands in a store.
+    Return the new board as a tuple, or None for an illegal move
+    """
+    seeds = board[house_num]
+    if not seeds or house_num < num_stores or house_num - seeds >= num_stores \
+            or house_num - seeds < 0:
+        return None
+    new_board = list(board)
+    for idx in range(house_num - seeds, house_num):
+        new_board[idx] += 1
+    new_board[house_num] = 0
+    return tuple(new_board)
+
+
+class MancalaRules:
+    """
+    Rules of a solitaire Mancala variant.  Houses 0 to num_stores - 1
+    are stores; the game is won when every other house is empty.
+    sowing(board, house_num, num_stores) returns the board after the
+    move as a tuple, or None if the move is illegal
+    """
+    
+    def __init__(self, num_stores=1, sowing=sow_seeds):
+        """
+        Create the rules, the default being Tchoukaillon
+        """
+        self._num_stores = num_stores
+        self._sowing = sowing
+    
+    def get_num_stores(self):
+        """
+        Return the number of stores
+        """
+        return self._num_stores
+    
+    def is_won(self, board):
+        """
+        Check whether all houses but the stores are empty
+        """
+        for idx in range(self._num_stores, len(board)):
+            if board[idx] != 0:
+                return False
+        return True
+    
+    def next_boards(self, board):
+        """
+        Return the list of (house_num, new_board) for the legal moves,
+        houses closest to the stores first
+        """
+        moves = []
+        for house_num in range(self._num_stores, len(board)):
+            new_board = self._sowing(board, house_num, self._num_stores)
+            if new_board is not None:
+                moves.append((house_num, new_board))
+        return moves
+
+
+class MancalaSolution:
+    """
+    Result of solve_mancala.  solvable is True with the winning moves,
+    False if no sequence wins, or None if the budget ran out first
+    """
+    
+    def __init__(self, solvable, moves, nodes, elapsed):
+        self.solvable = solvable
+        self.moves = moves
+        self.nodes = nodes
+        self.elapsed = elapsed
+        self.states_per_sec = nodes / max(elapsed, 1e-9)
+    
+    def __str__(self):
+        return "solvable=%s moves=%s nodes=%d states/sec=%.0f" % (
+            self.solvable, self.moves, self.nodes, self.states_per_sec)
+
+
+def solve_mancala(configuration, rules=None, max_nodes=1000000, time_limit=10.0):
+    """
+    Depth first search over all move sequences from configuration.
+    Boards are kept as tuples in a transposition table so each state
+    is expanded at most once: a state seen again either is on the
+    current path or already failed.
+    Returns a MancalaSolution
+    """
+    if rules is None:
+        rules = MancalaRules()
+    start = time.time()
+    deadline = start + time_limit
+    board = tuple(configuration)
+    seen = set([board])
+    path = []
+    stack = [iter(rules.next_boards(board))]
+    nodes = 1
+    if rules.is_won(board):
+        return MancalaSolution(True, [], nodes, time.time() - start)
+    while stack:
+        for house_num, new_board in stack[-1]:
+            if new_board in seen:
+                continue
+            seen.add(new_board)
+            nodes += 1
+            path.append(house_num)
+            if rules.is_won(new_board):
+                return MancalaSolution(True, path, nodes, time.time() - start)
+            if nodes >= max_nodes or (not nodes % 1024 and time.time() > deadline):
+                return MancalaSolution(None, None, nodes, time.time() - start)
+            stack.append(iter(rules.next_boards(new_board)))
+            break
+        else:
+            stack.pop()
+            if path:
+                path.pop()
+    return MancalaSolution(False, None, nodes, time.time() - start)
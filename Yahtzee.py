@@ -25,6 +25,46 @@ def gen_all_sequences(outcomes, length):
     return answer_set
 
 
+# weighted multisets already enumerated, keyed by (outcomes, length)
+MULTISET_CACHE = {}
+
+def gen_weighted_multisets(outcomes, length):
+    """
+    Enumerate the sorted multisets of outcomes of given length, each
+    with the number of sequences it stands for (multinomial weight).
+    The weights add up to len(outcomes) ** length.
+
+    Returns a list of (sequence, weight) pairs
+    """
+    key = (tuple(outcomes), length)
+    if key in MULTISET_CACHE:
+        return MULTISET_CACHE[key]
+    
+    factorials = [1]
+    for idx in range(1, length + 1):
+        factorials.append(factorials[-1] * idx)
+    
+    # choose how many dice show each outcome in turn
+    partial_list = [((), length, 1)]
+    for position, item in enumerate(outcomes):
+        temp_list = []
+        for partial_sequence, remaining, denominator in partial_list:
+            if position == len(outcomes) - 1:
+                counts = [remaining]
+            else:
+                counts = range(remaining + 1)
+            for count in counts:
+                temp_list.append((partial_sequence + (item,) * count,
+                                  remaining - count,
+                                  denominator * factorials[count]))
+        partial_list = temp_list
+    
+    answer_list = [(sequence, factorials[length] // denominator)
+                   for sequence, dummy_remaining, denominator in partial_list]
+    MULTISET_CACHE[key] = answer_list
+    return answer_list
+
+
 def score(hand):
     """
     Compute the maximal score for a Yahtzee hand according to the
@@ -62,14 +102,13 @@ def expected_value(held_dice, num_die_sides, num_free_dice):
     for item in range(1, num_die_sides + 1):
         outcomes.append(str(item))
     
-    # generate all the sequences of rolls
-    all_rolls = gen_all_sequences(outcomes, num_free_dice)
-    
+    # score each distinct roll once, weighted by the number of
+    # sequences giving it
     current_score = 0
-    for roll in all_rolls:
-        current_score += score(held_dice + roll)
+    for roll, weight in gen_weighted_multisets(outcomes, num_free_dice):
+        current_score += weight * score(held_dice + roll)
         
-    return current_score / float(len(all_rolls))
+    return current_score / float(num_die_sides ** num_free_dice)
     
 
 def gen_all_holds(hand):